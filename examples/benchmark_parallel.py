@@ -0,0 +1,92 @@
+import pandoramoon as pandora
+from pandoramoon.pandora import pandora as pandora_function, pandora_parallel
+from pandoramoon.pandora import pandora_batch, pandora_pool
+import numpy as np
+import numba
+import time as clock
+
+# Thread scaling of the multi-core functions, for 1, 2, 4 and all threads:
+# pandora_parallel() versus pandora() for one long light curve, and
+# pandora_batch() and pandora_pool() for a batch of parameter sets
+params = pandora.model_params()
+params.R_star = 696_342_000  # [m]
+params.u1 = 0.4089
+params.u2 = 0.2556
+
+# Planet parameters
+params.per_bary = 30.5  # [days]
+params.a_bary = 40  # [R_star]
+params.r_planet = 0.1  # [R_star]
+params.b_bary = 0.3  # [0..1]
+params.t0_bary = 11  # [days]
+params.t0_bary_offset = 0  # [days]
+params.M_planet = 1.8986e+27  # [kg]
+params.w_bary = 20  # [deg]
+params.ecc_bary = 0.2  # [0..1]
+
+# Moon parameters
+params.r_moon = 0.03526  # [R_star]
+params.per_moon = 1.5  # [days]
+params.tau_moon = 0.07  # [0..1]
+params.Omega_moon = 0  # [0..180]
+params.i_moon = 80  # [0..180]
+params.ecc_moon = 0  # [0..1]
+params.w_moon = 20  # [deg]
+params.M_moon = 0.05395 * params.M_planet  # [kg]
+
+# Long light curve: 4 years of 2-minute cadence around each transit
+params.epochs = 48  # [int]
+params.epoch_duration = 2  # [days]
+params.cadences_per_day = 720  # [int]
+params.epoch_distance = 30.5  # [days]
+params.supersampling_factor = 5  # [int]
+params.occult_small_threshold = 0.01  # [0..1]
+params.hill_sphere_threshold = 1.2
+params.numerical_grid = 25
+
+time = pandora.time(params).grid()
+cache = pandora.open_occult_spline_cache()
+arguments = (
+    params.u1, params.u2, params.R_star,
+    params.per_bary, params.a_bary, params.r_planet, params.b_bary, params.w_bary,
+    params.ecc_bary, params.t0_bary, params.t0_bary_offset, params.M_planet,
+    params.r_moon, params.per_moon, params.tau_moon, params.Omega_moon, params.i_moon,
+    params.ecc_moon, params.w_moon, params.M_moon,
+    params.epoch_distance, params.supersampling_factor, params.occult_small_threshold,
+    params.hill_sphere_threshold, params.numerical_grid, time, cache
+)
+
+
+def runtime(function, *arguments, repeats=10):
+    function(*arguments)  # compile
+    start = clock.perf_counter()
+    for repeat in range(repeats):
+        function(*arguments)
+    return (clock.perf_counter() - start) / repeats
+
+
+# Batch of 64 parameter sets with different moon phases, on the first 4 epochs
+batch_time = time[:4 * len(time) // params.epochs]
+batch = np.array([params.pack() for row in range(64)])
+batch[:, pandora.PARAMETERS.index("tau_moon")] = np.linspace(0, 1, 64)
+
+reference = pandora_function(*arguments)
+assert np.array_equal(reference[2], pandora_parallel(*arguments)[2])
+assert np.array_equal(
+    pandora_batch(batch, batch_time, cache), pandora_pool(batch, batch_time, cache)
+)
+cores = numba.config.NUMBA_NUM_THREADS
+serial = runtime(pandora_function, *arguments)
+print("Time stamps:", len(time), "Cores:", cores)
+print("pandora():", round(serial * 1000, 1), "ms")
+print("Batch of", len(batch), "parameter sets with", len(batch_time), "time stamps each")
+print("Threads  pandora_parallel() [ms]  pandora_batch() [ms]  pandora_pool() [ms]")
+for threads in sorted({threads for threads in (1, 2, 4, cores) if threads <= cores}):
+    numba.set_num_threads(threads)
+    parallel = runtime(pandora_parallel, *arguments)
+    batched = runtime(pandora_batch, batch, batch_time, cache)
+    pooled = runtime(pandora_pool, batch, batch_time, cache, None, threads)
+    print(
+        f"{threads:7d}  {parallel * 1000:23.1f}  {batched * 1000:20.1f}"
+        f"  {pooled * 1000:19.1f}"
+    )
@@ -0,0 +1,114 @@
+import os
+os.environ["NUMBA_NRT_STATS"] = "1"  # must be set before numba is imported
+
+import pandoramoon as pandora
+from pandoramoon.pandora import pandora as pandora_function, pandora_inplace, create_workspace
+from pandoramoon.occult import create_occult_cache, create_occult_spline_cache
+from pandoramoon.ellipse import create_kepler_cache
+from numba import jit
+from numba.core.runtime import rtsys
+import numpy as np
+
+# After the first call, pandora_inplace must not allocate on the heap: All
+# buffers, also those of the transit window, the occultations and the mutual
+# eclipses, come from the workspace. Its output must equal pandora().
+params = pandora.model_params()
+params.R_star = 696_342_000  # [m]
+params.u1 = 0.4089
+params.u2 = 0.2556
+
+# Planet parameters
+params.per_bary = 365.25  # [days]
+params.a_bary = 215  # [R_star]
+params.r_planet = 0.1  # [R_star]
+params.b_bary = 0.3  # [0..1]
+params.t0_bary = 11  # [days]
+params.t0_bary_offset = 0  # [days]
+params.M_planet = 1.8986e+27  # [kg]
+params.w_bary = 20  # [deg]
+params.ecc_bary = 0.2  # [0..1]
+
+# Moon parameters, with mutual eclipses
+params.r_moon = 0.03526  # [R_star]
+params.per_moon = 0.3  # [days]
+params.tau_moon = 0.07  # [0..1]
+params.Omega_moon = 0  # [0..180]
+params.i_moon = 89  # [0..180]
+params.ecc_moon = 0  # [0..1]
+params.w_moon = 20  # [deg]
+params.M_moon = 0.05395 * params.M_planet  # [kg]
+
+# Time grid
+params.epochs = 3  # [int]
+params.epoch_duration = 0.6  # [days]
+params.cadences_per_day = 500  # [int]
+params.epoch_distance = 365.25  # [days]
+params.supersampling_factor = 3  # [int]
+params.occult_small_threshold = 0.01  # [0..1]
+params.hill_sphere_threshold = 1.2
+params.numerical_grid = 25
+
+caches = {
+    "no cache": None,
+    "cache": create_occult_cache(params.u1, params.u2, dim=300),
+    "spline cache": create_occult_spline_cache(),
+}
+kepler_cache = create_kepler_cache()
+cadences = pandora.time(params).grid()[1::3]
+grids = {
+    "dense": pandora.time(params).grid(),
+    "descriptor": pandora.time(params).descriptor(),
+    "segmented": pandora.segmented_timegrid([
+        (cadences[::2], 3 / 1440, 3),
+        (cadences[1::2], 1 / 1440, 1),
+    ]),
+}
+
+
+@jit(nopython=True)
+def repeat(calls, *arguments):
+    for call in range(calls):
+        result = pandora_inplace(*arguments)
+    return result
+
+
+def allocations(*arguments):
+    """Heap allocations of one call, without those of passing the arguments
+    from Python: The difference between two calls and one call"""
+    counts = []
+    for calls in (1, 2):
+        before = rtsys.get_allocation_stats().alloc
+        result = repeat(calls, *arguments)
+        counts.append(rtsys.get_allocation_stats().alloc - before)
+    return counts[1] - counts[0], result
+
+
+for grid_name, time in grids.items():
+    for cache_name, cache in caches.items():
+        for numerical_grid in (25, 0, -3):
+            # ecc_moon as float in all cases: repeat() keeps one type signature
+            for r_moon, ecc_moon in ((0.03526, 0.), (0.005, 0.3)):
+                params.numerical_grid = numerical_grid
+                params.r_moon = r_moon
+                params.ecc_moon = ecc_moon
+                arguments = [getattr(params, name) for name in pandora.PARAMETERS]
+                workspace = create_workspace(time, params.supersampling_factor, 25, cache)
+                count, result = allocations(*arguments, time, workspace, cache, kepler_cache)
+                expected = pandora_function(*arguments, time, cache, kepler_cache)
+                difference = max(np.max(np.abs(a - b)) for a, b in zip(result, expected))
+                print(grid_name, cache_name, numerical_grid, r_moon, ecc_moon,
+                    "allocations", count, "difference", difference)
+                assert count == 0
+                assert difference == 0
+
+# A workspace for a smaller numerical_grid and without the cache still gives
+# the same model: Only the pixelart image and the row of the cache are allocated
+params.numerical_grid = 51
+arguments = [getattr(params, name) for name in pandora.PARAMETERS]
+cache = caches["spline cache"]
+workspace = create_workspace(time, params.supersampling_factor)
+count, result = allocations(*arguments, time, workspace, cache, kepler_cache)
+expected = pandora_function(*arguments, time, cache, kepler_cache)
+difference = max(np.max(np.abs(a - b)) for a, b in zip(result, expected))
+print("smaller workspace allocations", count, "difference", difference)
+assert difference == 0
@@ -0,0 +1,58 @@
+import pandoramoon as pandora
+from pandoramoon.pandora import pandora as pandora_function, pandora_loglike, PARAMETERS
+import numpy as np
+
+# The log-likelihood must not depend on whether the time grid is passed as a
+# dense array or as a descriptor. With 122 samples per epoch, which is not a
+# multiple of supersampling_factor = 5, some cadences straddle two epochs.
+params = pandora.model_params()
+params.R_star = 696_342_000  # [m]
+params.u1 = 0.4089
+params.u2 = 0.2556
+
+# Planet parameters
+params.per_bary = 365.25  # [days]
+params.a_bary = 215  # [R_star]
+params.r_planet = 0.1  # [R_star]
+params.b_bary = 0.3  # [0..1]
+params.t0_bary = 11  # [days]
+params.t0_bary_offset = 0  # [days]
+params.M_planet = 1.8986e+27  # [kg]
+params.w_bary = 20  # [deg]
+params.ecc_bary = 0.2  # [0..1]
+
+# Moon parameters
+params.r_moon = 0.03526  # [R_star]
+params.per_moon = 0.3  # [days]
+params.tau_moon = 0.07  # [0..1]
+params.Omega_moon = 0  # [0..180]
+params.i_moon = 80  # [0..180]
+params.ecc_moon = 0  # [0..1]
+params.w_moon = 20  # [deg]
+params.M_moon = 0.05395 * params.M_planet  # [kg]
+
+# Time grid
+params.epochs = 3  # [int]
+params.epoch_duration = 0.51  # [days]
+params.cadences_per_day = 48  # [int]
+params.epoch_distance = 365.25  # [days]
+params.supersampling_factor = 5  # [int]
+params.occult_small_threshold = 0.01  # [0..1]
+params.hill_sphere_threshold = 1.2
+params.numerical_grid = 25
+
+grid = pandora.time(params)
+dense = grid.grid()
+descriptor = grid.descriptor()
+arguments = [getattr(params, name) for name in PARAMETERS]
+flux = pandora_function(*arguments, dense)[2]
+data = flux + np.random.default_rng(0).normal(0, 1e-4, len(flux))
+yerr = np.full(len(flux), 1e-4)
+
+for tolerance, nodes in ((0., 0), (1e-6, 0), (0., 5)):
+    loglike_dense = pandora_loglike(
+        *arguments, dense, data, yerr, None, None, tolerance, nodes)
+    loglike_descriptor = pandora_loglike(
+        *arguments, descriptor, data, yerr, None, None, tolerance, nodes)
+    print(tolerance, nodes, loglike_dense, loglike_descriptor)
+    assert abs(loglike_dense - loglike_descriptor) < 1e-6 * abs(loglike_dense)
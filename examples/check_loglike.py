@@ -0,0 +1,53 @@
+import pandoramoon as pandora
+from pandoramoon.pandora import pandora as pandora_function, pandora_loglike
+import numpy as np
+
+# Without a cache, pandora() evaluates the occultations with occult() and
+# pandora_loglike() with occult_single_value(), cadence by cadence. Both must
+# give the same model, also during ingress and egress: With data = pandora()
+# and tiny errors, the log-likelihood measures the difference of the models.
+params = pandora.model_params()
+params.R_star = 696_342_000  # [m]
+params.u1 = 0.4089
+params.u2 = 0.2556
+
+# Planet parameters
+params.per_bary = 365.25  # [days]
+params.a_bary = 215  # [R_star]
+params.b_bary = 0.3  # [0..1]
+params.t0_bary = 11  # [days]
+params.t0_bary_offset = 0  # [days]
+params.M_planet = 1.8986e+27  # [kg]
+params.w_bary = 20  # [deg]
+params.ecc_bary = 0.2  # [0..1]
+
+# Moon parameters
+params.per_moon = 0.3  # [days]
+params.tau_moon = 0.07  # [0..1]
+params.Omega_moon = 0  # [0..180]
+params.i_moon = 80  # [0..180]
+params.ecc_moon = 0  # [0..1]
+params.w_moon = 20  # [deg]
+params.M_moon = 0.05395 * params.M_planet  # [kg]
+
+# Time grid
+params.epochs = 2  # [int]
+params.epoch_duration = 0.6  # [days]
+params.cadences_per_day = 2000  # [int]
+params.epoch_distance = 365.25  # [days]
+params.supersampling_factor = 1  # [int]
+params.occult_small_threshold = 0.01  # [0..1]
+params.hill_sphere_threshold = 1.2
+params.numerical_grid = 25
+
+time = pandora.time(params).grid()
+yerr = np.full(len(time), 1e-6)
+for r_planet, r_moon in ((0.1, 0.03526), (0.02, 0.015), (0.3, 0.1)):
+    params.r_planet = r_planet
+    params.r_moon = r_moon
+    arguments = [getattr(params, name) for name in pandora.PARAMETERS]
+    flux = pandora_function(*arguments, time)[2]
+    loglike = pandora_loglike(*arguments, time, flux, yerr)
+    rms = np.sqrt(-2 * loglike / len(time)) * 1e-6
+    print(r_planet, r_moon, "rms difference", rms)
+    assert rms < 1e-12
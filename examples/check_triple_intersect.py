@@ -0,0 +1,28 @@
+from pandoramoon.eclipse import triple_intersect
+from numpy import pi, sqrt, arccos
+
+# Common overlap of three circles, compared to known areas. Each case is also
+# evaluated for all orders of the circles, which must give the same area.
+def lens(d, r):
+    """Overlap of two circles with radius r at distance d"""
+    return 2 * r ** 2 * arccos(d / (2 * r)) - d / 2 * sqrt(4 * r ** 2 - d ** 2)
+
+cases = (
+    # Three identical circles
+    (((0, 0, 1), (0, 0, 1), (0, 0, 1)), pi),
+    # Two identical circles, and a larger concentric one
+    (((0, 0, 1), (0, 0, 1), (0, 0, 2)), pi),
+    # Two identical circles inside a third one
+    (((0.5, 0, 0.2), (0.5, 0, 0.2), (0, 0, 1)), pi * 0.2 ** 2),
+    # Two identical circles, overlapping the third one
+    (((0, 0, 1), (0, 0, 1), (1, 0, 1)), lens(1, 1)),
+    # Concentric circles of different size
+    (((0, 0, 1), (0, 0, 0.5), (0, 0, 0.3)), pi * 0.3 ** 2),
+    # Disjoint circles
+    (((0, 0, 1), (3, 0, 1), (1, 0, 0.5)), 0),
+)
+for circles, area in cases:
+    for order in ((0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 2, 0), (2, 0, 1), (2, 1, 0)):
+        result = triple_intersect(*circles[order[0]], *circles[order[1]], *circles[order[2]])
+        assert abs(result - area) < 1e-12, (circles, order, result, area)
+print("triple_intersect: all cases agree")
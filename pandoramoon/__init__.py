@@ -1,2 +1,6 @@
-from pandoramoon.pandora import pandora, model_params, time, moon_model
-from pandoramoon.occult import create_occult_cache
\ No newline at end of file
+from pandoramoon.pandora import pandora, pandora_batch, pandora_bands, pandora_packed, pandora_parallel, pandora_pool, incremental_model, pandora_loglike, pandora_inplace, physical_moon, create_workspace, model_params, time, moon_model, PARAMETERS
+from pandoramoon.occult import create_occult_cache, create_occult_component_cache, create_occult_spline_cache
+from pandoramoon.cache_store import open_occult_cache, open_occult_component_cache, open_occult_spline_cache
+from pandoramoon.cache_store import load_occult_cache, share_occult_cache, unshare_occult_cache
+from pandoramoon.ellipse import create_kepler_cache
+from pandoramoon.grids import timegrid_descriptor, expand_timegrid, segmented_timegrid
@@ -0,0 +1,216 @@
+import numpy as np
+import os
+import tempfile
+from hashlib import sha1
+
+from pandoramoon.occult import create_occult_cache, create_occult_component_cache
+from pandoramoon.occult import create_occult_spline_cache
+
+
+# Binary layout of a cache file, all values little-endian:
+#   header  (64 bytes): magic (8 bytes), format version (uint32), kind (uint32),
+#                       dim_k, dim_z (uint32), u1, u2, k_min, k_max, z_max (float64)
+#   tables  (tables * dim_k * dim_z float32): flux, or the components le, ld, ed
+#   ks      (dim_k float64)
+#   zs      (dim_z float64), not for the spline cache which has no z grid
+# Increase FORMAT_VERSION whenever the layout or the cached model changes.
+MAGIC = b"PANDORAM"
+FORMAT_VERSION = 2
+HEADER = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("kind", "<u4"),
+    ("dim_k", "<u4"),
+    ("dim_z", "<u4"),
+    ("u1", "<f8"),
+    ("u2", "<f8"),
+    ("k_min", "<f8"),
+    ("k_max", "<f8"),
+    ("z_max", "<f8"),
+])
+KIND_FLUX = 0
+KIND_COMPONENTS = 1
+KIND_SPLINE = 2
+
+
+def default_cache_dir():
+    """Directory of the cache files: $PANDORA_CACHE_DIR, else ~/.cache/pandoramoon"""
+    directory = os.environ.get("PANDORA_CACHE_DIR")
+    if directory is None:
+        directory = os.path.join(os.path.expanduser("~"), ".cache", "pandoramoon")
+    return directory
+
+
+def cache_filename(kind, u1, u2, dim_k, dim_z, k_min, k_max, z_max, directory=None):
+    """File name of a cache, unique for its kind, parameters and the format version"""
+    if directory is None:
+        directory = default_cache_dir()
+    key = repr((FORMAT_VERSION, kind, float(u1), float(u2), int(dim_k), int(dim_z),
+        float(k_min), float(k_max), float(z_max)))
+    name = "occult_v" + str(FORMAT_VERSION) + "_" + sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(directory, name + ".bin")
+
+
+def save_occult_cache(filename, cache, u1=0, u2=0):
+    """Writes a cache from create_occult_cache, create_occult_component_cache or
+    create_occult_spline_cache. The file is written under a temporary name and
+    renamed afterwards, so that concurrent readers never see a partial file."""
+    if len(cache) == 4:
+        kind = KIND_SPLINE
+        tables = np.ascontiguousarray(np.array(cache[:3], dtype="<f4"))
+        ks = np.ascontiguousarray(cache[3], dtype="<f8")
+        zs = np.empty(0, dtype="<f8")
+        z_max = 1 + ks[-1]
+    else:
+        kind = KIND_FLUX if len(cache) == 3 else KIND_COMPONENTS
+        tables = np.ascontiguousarray(np.array(cache[:-2], dtype="<f4"))
+        ks = np.ascontiguousarray(cache[-2], dtype="<f8")
+        zs = np.ascontiguousarray(cache[-1], dtype="<f8")
+        z_max = zs[-1]
+    header = np.zeros(1, dtype=HEADER)
+    header["magic"] = MAGIC
+    header["version"] = FORMAT_VERSION
+    header["kind"] = kind
+    header["dim_k"] = tables.shape[1]
+    header["dim_z"] = tables.shape[2]
+    header["u1"] = u1
+    header["u2"] = u2
+    header["k_min"] = ks[0]
+    header["k_max"] = ks[-1]
+    header["z_max"] = z_max
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    handle, temp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(header.tobytes())
+            f.write(tables.tobytes())
+            f.write(ks.tobytes())
+            f.write(zs.tobytes())
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def load_occult_cache(filename):
+    """Maps a cache file read-only into memory. All processes which load the same
+    file share one copy in the page cache. Returns the same tuple as
+    create_occult_cache (fs, ks, zs), create_occult_component_cache
+    (les, lds, eds, ks, zs) or create_occult_spline_cache (les, lds, eds, ks),
+    depending on the kind of the file."""
+    header = np.fromfile(filename, dtype=HEADER, count=1)
+    if len(header) != 1 or header["magic"][0] != MAGIC:
+        raise ValueError("Not a Pandora cache file: " + filename)
+    if header["version"][0] != FORMAT_VERSION:
+        raise ValueError("Unsupported cache file version: " + filename)
+    kind = header["kind"][0]
+    dim_k = int(header["dim_k"][0])
+    dim_z = int(header["dim_z"][0])
+    if kind == KIND_FLUX:
+        n_tables = 1
+    else:
+        n_tables = 3
+    offset = HEADER.itemsize
+    tables = np.memmap(
+        filename, dtype="<f4", mode="r", offset=offset, shape=(n_tables, dim_k, dim_z)
+    )
+    offset += tables.nbytes
+    ks = np.memmap(filename, dtype="<f8", mode="r", offset=offset, shape=(dim_k,))
+    tables = np.asarray(tables)
+    if kind == KIND_SPLINE:
+        return (tables[0], tables[1], tables[2], np.asarray(ks))
+    offset += ks.nbytes
+    zs = np.memmap(filename, dtype="<f8", mode="r", offset=offset, shape=(dim_z,))
+    if n_tables == 1:
+        return (tables[0], np.asarray(ks), np.asarray(zs))
+    return (tables[0], tables[1], tables[2], np.asarray(ks), np.asarray(zs))
+
+
+def shared_cache_dir():
+    """Directory of shared caches: /dev/shm where available, else the temporary directory"""
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def share_occult_cache(cache, u1=0, u2=0, directory=None):
+    """Publishes a cache in shared memory, as a file in `directory` (default
+    shared_cache_dir()). Returns its name. Worker processes attach to it with
+    load_occult_cache(name) without copying, also when started via MPI. Call
+    unshare_occult_cache(name) when all workers are done."""
+    if directory is None:
+        directory = shared_cache_dir()
+    handle, filename = tempfile.mkstemp(dir=directory, prefix="pandora_occult_", suffix=".bin")
+    os.close(handle)
+    try:
+        save_occult_cache(filename, cache, u1, u2)
+    except BaseException:
+        os.remove(filename)
+        raise
+    return filename
+
+
+def unshare_occult_cache(name):
+    """Removes a cache published with share_occult_cache. Processes which are
+    attached to it keep their mapping until they release the arrays."""
+    os.remove(name)
+
+
+def open_occult_cache(
+    u1, u2, dim=300, k_min=0.001, k_max=0.1, z_max=None, directory=None
+):
+    """Same as create_occult_cache, but the table is built only once per
+    (u1, u2, dim, grid ranges), stored on disk and memory-mapped afterwards.
+    If the cache directory is not writable, the table is kept in memory."""
+    if z_max is None:
+        z_max = 1 + k_max
+    filename = cache_filename(
+        KIND_FLUX, u1, u2, dim, dim, k_min, k_max, z_max, directory
+    )
+    if os.path.exists(filename):
+        return load_occult_cache(filename)
+    cache = create_occult_cache(u1, u2, dim, k_min, k_max, z_max)
+    try:
+        save_occult_cache(filename, cache, u1, u2)
+    except OSError:
+        return cache
+    return load_occult_cache(filename)
+
+
+def open_occult_component_cache(
+    dim=300, k_min=0.001, k_max=0.1, z_max=None, directory=None
+):
+    """Same as create_occult_component_cache, stored on disk and memory-mapped"""
+    if z_max is None:
+        z_max = 1 + k_max
+    filename = cache_filename(
+        KIND_COMPONENTS, 0, 0, dim, dim, k_min, k_max, z_max, directory
+    )
+    if os.path.exists(filename):
+        return load_occult_cache(filename)
+    cache = create_occult_component_cache(dim, k_min, k_max, z_max)
+    try:
+        save_occult_cache(filename, cache)
+    except OSError:
+        return cache
+    return load_occult_cache(filename)
+
+
+def open_occult_spline_cache(
+    dim_k=48, dim_s=129, k_min=0.001, k_max=0.5, directory=None
+):
+    """Same as create_occult_spline_cache, stored on disk and memory-mapped"""
+    if dim_s % 2 == 0:
+        dim_s += 1
+    filename = cache_filename(
+        KIND_SPLINE, 0, 0, dim_k, dim_s, k_min, k_max, 1 + k_max, directory
+    )
+    if os.path.exists(filename):
+        return load_occult_cache(filename)
+    cache = create_occult_spline_cache(dim_k, dim_s, k_min, k_max)
+    try:
+        save_occult_cache(filename, cache)
+    except OSError:
+        return cache
+    return load_occult_cache(filename)
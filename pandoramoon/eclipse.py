@@ -1,5 +1,5 @@
 import numpy as np
-from numpy import sqrt, pi, arccos, abs, ceil, fliplr, flipud
+from numpy import sqrt, pi, arccos, arctan2, sin, cos, abs, ceil
 from numba import jit
 
 
@@ -42,11 +42,19 @@ def eclipse_ratio(distance_planet_moon, r_planet, r_moon):
 
 
 @jit(cache=True, nopython=True, fastmath=True, parallel=False)
-def pixelart(xp, yp, xm, ym, r_planet, r_moon, numerical_grid):
+def pixelart(xp, yp, xm, ym, r_planet, r_moon, numerical_grid, image=None):
+    """Fraction of the moon's transit depth which is hidden by the planet, on a
+    raster of numerical_grid**2 pixels. The raster is painted into `image` if
+    given, an int8 array with at least the length of raster_length(numerical_grid)"""
     if numerical_grid % 2 == 0:  # assure pixel number is odd for perfect circle
         numerical_grid += 1
     r_star = (1 / r_moon) * numerical_grid
-    image = np.zeros((numerical_grid + 1, numerical_grid + 1), dtype="int8")
+    size = numerical_grid + 1
+    if image is None:
+        raster = np.zeros((size, size), dtype="int8")
+    else:
+        raster = image[:size * size].reshape((size, size))
+        raster[:] = 0
     
     color_star = 5    # arbitrary values, but useful for visualization
     color_moon = 3    # the sum of the values must be unique to identify the
@@ -57,6 +65,7 @@ def pixelart(xp, yp, xm, ym, r_planet, r_moon, numerical_grid):
     # Faster than painting naively the full circle, because it saves 3/4 of dist calcs
     # Caching this part would be a good idea, but numba memory mgmt caused crashes
     # The gain is very small anyways and the complexity not worth it
+    # (pixelart_adaptive uses the precomputed cells of MOON_TEMPLATE instead)
     # The version here, which replaces the usual sqrt with **2, is ~5% faster
 
     # Paint upper left corner
@@ -66,12 +75,19 @@ def pixelart(xp, yp, xm, ym, r_planet, r_moon, numerical_grid):
         for y in range(mid):
             d_moon = (numerical_grid - 2 * x) ** 2 + (numerical_grid - 2 * y) ** 2
             if d_moon < (numerical_grid**2 + anti_aliasing):
-                image[x, y] = color_moon
-    image[mid:,:mid] = flipud(image[:mid:,:mid]) # Copy upper left to upper right
-    image[:,mid:] = fliplr(image[:,:mid])  # Copy upper half to lower half
+                raster[x, y] = color_moon
+    # Copy upper left to upper right, then upper half to lower half. Loops
+    # instead of flipud and fliplr, which copy overlapping views.
+    for x in range(mid):
+        for y in range(mid):
+            raster[mid + x, y] = raster[mid - 1 - x, y]
+    for x in range(size):
+        for y in range(mid):
+            raster[x, mid + y] = raster[x, mid - 1 - y]
 
-    # Now add planet and star
+    # Now add planet and star, and count the pixels with all colors
     anti_aliasing = -0.5 / numerical_grid  # Working with sqrt again
+    occulted = 0
     for x in range(numerical_grid + 1):
         for y in range(numerical_grid + 1):
             d_star = sqrt(
@@ -79,17 +95,19 @@ def pixelart(xp, yp, xm, ym, r_planet, r_moon, numerical_grid):
                 + (ym * r_star + 2 * y - numerical_grid) ** 2
             )
             if d_star < r_star - anti_aliasing:
-                image[x, y] += color_star
+                raster[x, y] += color_star
 
             d_planet = sqrt(
                 ((-(xp - xm) * r_star) + 2 * x - numerical_grid) ** 2
                 + ((-(yp - ym) * r_star) + 2 * y - numerical_grid) ** 2
             )
             if d_planet < (r_planet / r_moon) * numerical_grid - anti_aliasing:
-                image[x, y] += color_planet
+                raster[x, y] += color_planet
+            if raster[x, y] == all_colors:
+                occulted += 1
 
     moon_sum_analytical = pi * ((numerical_grid) / 2) ** 2
-    moon_occult_frac = np.sum(image == all_colors) / moon_sum_analytical
+    moon_occult_frac = occulted / moon_sum_analytical
     cci = eclipse_ratio(sqrt(xm ** 2 + ym ** 2), 1, r_moon)
     if cci > 0:
         return min(1, (1 - ((cci - moon_occult_frac) / cci)))
@@ -97,6 +115,208 @@ def pixelart(xp, yp, xm, ym, r_planet, r_moon, numerical_grid):
         return 1
 
 
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def arc_inside(x1, y1, r1, x2, y2, r2, first):
+    """Part of the boundary of circle 1 which lies inside circle 2, as the angle
+    (start) and the angular length of the arc. Length 0: no part, 2 pi: all.
+    If both circles are the same, their common boundary must be counted once:
+    It is inside for the `first` of the two circles only"""
+    d = sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+    if d == 0 and r1 == r2:
+        if first:
+            return 0., 2 * pi
+        return 0., 0.
+    if d + r1 <= r2:
+        return 0., 2 * pi
+    if d >= r1 + r2 or d + r2 <= r1:
+        return 0., 0.
+    half = arccos(min(max((d ** 2 + r1 ** 2 - r2 ** 2) / (2 * d * r1), -1), 1))
+    start = arctan2(y2 - y1, x2 - x1) - half
+    if start < 0:
+        start += 2 * pi
+    return start, 2 * half
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def arc_area(x, y, r, t1, t2):
+    """Line integral 1/2 (x dy - y dx) along the circle (x, y, r) from angle t1 to t2"""
+    return 0.5 * (
+        r ** 2 * (t2 - t1)
+        + x * r * (sin(t2) - sin(t1))
+        - y * r * (cos(t2) - cos(t1))
+    )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def common_arcs_area(x, y, r, start_1, length_1, start_2, length_2):
+    """Line integral of arc_area along the part of the circle (x, y, r) which is
+    in both arcs. Arc 2 is shifted by one turn in both directions, so that the
+    intersection of the two arcs can be found as overlaps of intervals"""
+    area = 0.
+    for shift in (-2 * pi, 0., 2 * pi):
+        t1 = max(start_1, start_2 + shift)
+        t2 = min(start_1 + length_1, start_2 + length_2 + shift)
+        if t2 > t1:
+            area += arc_area(x, y, r, t1, t2)
+    return area
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def triple_intersect(x1, y1, r1, x2, y2, r2, x3, y3, r3):
+    """Area of the common overlap of three circles. The overlap is bounded by
+    those arcs of each circle that lie inside the two other circles. With Green's
+    theorem, the area is the sum of the line integrals along these arcs.
+    Identical circles share their boundary, which belongs to the first of them."""
+    start_2, length_2 = arc_inside(x1, y1, r1, x2, y2, r2, True)
+    start_3, length_3 = arc_inside(x1, y1, r1, x3, y3, r3, True)
+    area = common_arcs_area(x1, y1, r1, start_2, length_2, start_3, length_3)
+    start_1, length_1 = arc_inside(x2, y2, r2, x1, y1, r1, False)
+    start_3, length_3 = arc_inside(x2, y2, r2, x3, y3, r3, True)
+    area += common_arcs_area(x2, y2, r2, start_1, length_1, start_3, length_3)
+    start_1, length_1 = arc_inside(x3, y3, r3, x1, y1, r1, False)
+    start_2, length_2 = arc_inside(x3, y3, r3, x2, y2, r2, False)
+    area += common_arcs_area(x3, y3, r3, start_1, length_1, start_2, length_2)
+    return area
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipse_ratio_limb(xp, yp, xm, ym, r_planet, r_moon):
+    """Exact version of pixelart: The fraction of the moon area in front of the
+    star, which is occulted by the planet. Star at (0, 0) with radius 1."""
+    moon_on_star = cci(1, r_moon, sqrt(xm ** 2 + ym ** 2))
+    if moon_on_star <= 0:
+        return 1
+    overlap = triple_intersect(0, 0, 1, xp, yp, r_planet, xm, ym, r_moon)
+    return min(1, overlap / moon_on_star)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def moon_template(depth):
+    """Cells (x, y, half width, on edge) covering the moon disk with radius 1 at
+    (0, 0): The largest cells inside the disk, and the cells on its edge down to
+    `depth`, where the cell width is 2 / 2**depth. Reused by pixelart_adaptive
+    for all cadences and calls, so that the moon disk is never rasterized again"""
+    cells = np.empty((4 * 4 ** depth, 4))
+    count = 0
+    stack = np.empty((4 * depth + 4, 3))
+    stack[0] = (0., 0., 1.)
+    top = 1
+    while top > 0:
+        top -= 1
+        x, y, h = stack[top]
+        d = sqrt(x ** 2 + y ** 2)
+        if d - h * sqrt(2) >= 1:  # outside
+            continue
+        if d + h * sqrt(2) <= 1:  # inside
+            cells[count] = (x, y, h, 0.)
+            count += 1
+        elif h <= 2. ** -depth:  # smallest cell on the edge
+            cells[count] = (x, y, h, 1.)
+            count += 1
+        else:
+            h /= 2
+            stack[top] = (x - h, y - h, h)
+            stack[top + 1] = (x + h, y - h, h)
+            stack[top + 2] = (x - h, y + h, h)
+            stack[top + 3] = (x + h, y + h, h)
+            top += 4
+    return cells[:count].copy()
+
+
+MOON_TEMPLATE = moon_template(4)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def pixelart_depth(r_moon, tolerance):
+    """Refinement depth of pixelart_adaptive for a max. error of the moon flux of
+    about `tolerance`. The error of the eclipsed fraction of the moon area is
+    below 0.6 / 2**depth, and the moon flux scales with its area r_moon**2"""
+    depth = int(ceil(np.log2(0.6 * r_moon ** 2 / tolerance)))
+    return min(max(depth, 1), 20)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def pixelart_adaptive(xp, yp, xm, ym, r_planet, r_moon, depth, stack=None):
+    """Same as pixelart, but on a quadtree: Starting from MOON_TEMPLATE, only the
+    cells crossed by the edge of the star, planet or moon are refined, down to
+    a cell width of 2 r_moon / 2**depth. The cost grows with 2**depth (edges)
+    instead of 4**depth (area) for the uniform grid of pixelart.
+    The cells to visit are kept in `stack` if given, with at least 4 * depth + 4
+    rows of 4 values"""
+    # Coordinates centered on the moon, in units of r_moon
+    x_star = -xm / r_moon
+    y_star = -ym / r_moon
+    r_star = 1 / r_moon
+    x_planet = (xp - xm) / r_moon
+    y_planet = (yp - ym) / r_moon
+    r_planet_moon = r_planet / r_moon
+    smallest = 2. ** -depth
+
+    area = 0.
+    if stack is None:
+        cells = np.empty((4 * depth + 4, 4))
+    else:
+        cells = stack
+    for cell in range(len(MOON_TEMPLATE)):
+        cells[0] = MOON_TEMPLATE[cell]
+        top = 1
+        while top > 0:
+            top -= 1
+            x, y, h, on_edge = cells[top]
+            # Squared distances, compared to the squared radii enlarged or
+            # reduced by the half diagonal of the cell
+            corner = h * sqrt(2)
+            d_star = (x - x_star) ** 2 + (y - y_star) ** 2
+            d_planet = (x - x_planet) ** 2 + (y - y_planet) ** 2
+            d_moon = x ** 2 + y ** 2
+            if (
+                d_star >= (r_star + corner) ** 2
+                or d_planet >= (r_planet_moon + corner) ** 2
+                or (on_edge and d_moon >= (1 + corner) ** 2)
+            ):
+                continue
+            if (
+                r_planet_moon > corner
+                and d_star <= (r_star - corner) ** 2
+                and d_planet <= (r_planet_moon - corner) ** 2
+                and (not on_edge or d_moon <= (1 - corner) ** 2)
+            ):
+                area += 4 * h ** 2
+            elif h <= smallest:
+                # Smallest cell: Sample at its center
+                if d_star < r_star ** 2 and d_planet < r_planet_moon ** 2 and d_moon < 1:
+                    area += 4 * h ** 2
+            else:
+                h /= 2
+                cells[top] = (x - h, y - h, h, on_edge)
+                cells[top + 1] = (x + h, y - h, h, on_edge)
+                cells[top + 2] = (x - h, y + h, h, on_edge)
+                cells[top + 3] = (x + h, y + h, h, on_edge)
+                top += 4
+
+    moon_occult_frac = area / pi
+    cci = eclipse_ratio(sqrt(xm ** 2 + ym ** 2), 1, r_moon)
+    if cci > 0:
+        return min(1, moon_occult_frac / cci)
+    else:
+        return 1
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipses_occur(a_moon, ecc_moon, i_moon, r_planet, r_moon):
+    """Broad phase: False if the orbit never brings planet and moon close enough
+    for a mutual eclipse. Their projected separation is at least the periapsis
+    distance a_moon * (1 - ecc_moon), shortened by the inclination (in deg)"""
+    closest = a_moon * (1 - ecc_moon) * abs(np.cos(i_moon / 180 * pi))
+    return closest < r_planet + r_moon
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipse_candidates(xp, yp, xm, ym, r_planet, r_moon):
+    """Broad phase: Indexes of the cadences with overlapping planet and moon"""
+    return np.nonzero((xm - xp) ** 2 + (ym - yp) ** 2 < (r_planet + r_moon) ** 2)[0]
+
+
 @jit(cache=True, nopython=True, fastmath=True, parallel=False)
 def eclipse(xp, yp, xm, ym, r_planet, r_moon, flux_moon, numerical_grid):
     """Checks if planet-moon occultation present. If yes, returns adjusted moon flux.
@@ -108,6 +328,10 @@ def eclipse(xp, yp, xm, ym, r_planet, r_moon, flux_moon, numerical_grid):
         Planet and moon radii. Normalized so that R_star = 1
     flux_moon : float
         Un-occulted moon flux (from Mandel-Agol model) in [0,1]
+    numerical_grid : int
+        Resolution of pixelart for occultations on the stellar limb.
+        0 uses the exact area from eclipse_ratio_limb instead. Negative values
+        use pixelart_adaptive with a tolerance of 10**numerical_grid in flux
 
     Returns
     -------
@@ -115,48 +339,114 @@ def eclipse(xp, yp, xm, ym, r_planet, r_moon, flux_moon, numerical_grid):
         Occulted moon flux <= flux_moon. Assumes planet occults moon.
     """
 
+    for idx in range(len(xp)):
+        flux_moon[idx] = eclipse_single_value(
+            xp[idx],
+            yp[idx],
+            xm[idx],
+            ym[idx],
+            r_planet,
+            r_moon,
+            flux_moon[idx],
+            numerical_grid
+        )
+    return flux_moon
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipse_single_value(
+    xp, yp, xm, ym, r_planet, r_moon, flux_moon, numerical_grid, buffers=None
+):
+    """Same as eclipse, but for the coordinates and moon flux of a single cadence.
+    buffers: see eclipse_ratio_single_value"""
+    er = eclipse_ratio_single_value(
+        xp, yp, xm, ym, r_planet, r_moon, numerical_grid, buffers
+    )
+    return eclipsed_flux(flux_moon, er)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipse_ratio_single_value(
+    xp, yp, xm, ym, r_planet, r_moon, numerical_grid, buffers=None
+):
+    """Fraction of the moon's transit depth which is hidden by the planet, for the
+    coordinates of a single cadence. Independent of limb darkening. The numerical
+    solutions use the buffers (image, stack) from eclipse_buffers if given; an
+    image for a smaller numerical_grid is not used."""
+
     # Planet-Moon occultation
     # Case 1: No occultation
     # Case 2: Occultation, both bodies on star or off star --> 2-circle intersect
-    # Case 3: Occultation, any body on limb --> Numerical solution
-    for idx in range(len(xp)):
-        planet_moon_occultation = False
-        on_limb = False
+    # Case 3: Occultation, any body on limb --> Numerical solution, or the exact
+    #         area of the star-planet-moon overlap for numerical_grid = 0
 
-        # Check if moon or planet are on stellar limb
-        if abs(1 - (sqrt(xm[idx] ** 2 + ym[idx] ** 2))) < (r_moon):
-            on_limb = True
-        if abs(1 - (sqrt(xp[idx] ** 2 + yp[idx] ** 2))) < (r_planet):
-            on_limb = True
+    # Case 1: No occultation. Checked first without sqrt, as it is most common
+    if (xm - xp) ** 2 + (ym - yp) ** 2 >= (r_planet + r_moon) ** 2:
+        return 0.
+    distance_p_m = sqrt((xm - xp) ** 2 + (ym - yp) ** 2)
 
-        # Check if planet-moon occultation
-        distance_p_m = sqrt((xm[idx] - xp[idx]) ** 2 + (ym[idx] - yp[idx]) ** 2)
-        if abs(distance_p_m) < (r_planet + r_moon):
-            planet_moon_occultation = True
+    # Check if moon or planet are on stellar limb
+    on_limb = False
+    if abs(1 - (sqrt(xm ** 2 + ym ** 2))) < (r_moon):
+        on_limb = True
+    if abs(1 - (sqrt(xp ** 2 + yp ** 2))) < (r_planet):
+        on_limb = True
 
-        # Case 1: No occultation
+    # Case 2: Occultation, both bodies on star or off star --> 2 circle intersect
+    if not on_limb:
+        er = eclipse_ratio(distance_p_m, r_planet, r_moon)
+
+    # Case 3: Occultation, any body on limb --> exact, or numerical estimate
+    elif numerical_grid == 0:
+        er = eclipse_ratio_limb(xp, yp, xm, ym, r_planet, r_moon)
+    elif numerical_grid < 0:
+        depth = pixelart_depth(r_moon, 10. ** numerical_grid)
+        if buffers is None:
+            er = pixelart_adaptive(xp, yp, xm, ym, r_planet, r_moon, depth)
         else:
-            continue
+            er = pixelart_adaptive(xp, yp, xm, ym, r_planet, r_moon, depth, buffers[1])
+    elif buffers is not None and len(buffers[0]) >= raster_length(numerical_grid):
+        er = pixelart(xp, yp, xm, ym, r_planet, r_moon, numerical_grid, buffers[0])
+    else:
+        er = pixelart(xp, yp, xm, ym, r_planet, r_moon, numerical_grid)
+    return er
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def raster_length(numerical_grid):
+    """Number of pixels of the image of pixelart for numerical_grid"""
+    if numerical_grid <= 0:
+        return 0
+    if numerical_grid % 2 == 0:
+        numerical_grid += 1
+    return (numerical_grid + 1) ** 2
 
-        # Case 2: Occultation, both bodies on star or off star --> 2 circle intersect
-        if planet_moon_occultation and not on_limb:
-            er = eclipse_ratio(distance_p_m, r_planet, r_moon)
-
-        # Case 3: Occultation, any body on limb --> numerical estimate with pixel-art
-        if planet_moon_occultation and on_limb:
-            er = pixelart(
-                xp[idx],
-                yp[idx],
-                xm[idx],
-                ym[idx],
-                r_planet,
-                r_moon,
-                numerical_grid
-            )
 
-        # For Cases 2+3: Calculate reduced moon flux
-        if er > 0:
-            flux_moon[idx] = -(1 - flux_moon[idx]) * 10 ** 6
-            flux_moon[idx] = flux_moon[idx] * (1 - er)
-            flux_moon[idx] = 1 - (-flux_moon[idx] * 10 ** -6)
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipse_buffers(numerical_grid):
+    """Buffers (image, stack) of eclipse_ratio_single_value: The image of pixelart
+    for numerical_grid, and the stack of pixelart_adaptive for the largest depth
+    of pixelart_depth (20)"""
+    return np.empty(raster_length(numerical_grid), dtype=np.int8), np.empty((84, 4))
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipse_ratios(xp, yp, xm, ym, r_planet, r_moon, numerical_grid):
+    """Same as eclipse_ratio_single_value, for arrays of coordinates. Computed once,
+    the ratios can be applied to moon fluxes of any limb darkening with eclipsed_flux"""
+    ratios = np.empty(len(xp))
+    for idx in range(len(xp)):
+        ratios[idx] = eclipse_ratio_single_value(
+            xp[idx], yp[idx], xm[idx], ym[idx], r_planet, r_moon, numerical_grid
+        )
+    return ratios
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipsed_flux(flux_moon, er):
+    """Moon flux reduced by the eclipse ratio `er`"""
+    if er > 0:
+        flux_moon = -(1 - flux_moon) * 10 ** 6
+        flux_moon = flux_moon * (1 - er)
+        flux_moon = 1 - (-flux_moon * 10 ** -6)
     return flux_moon
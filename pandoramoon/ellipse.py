@@ -2,22 +2,34 @@ import numpy as np
 from numpy import sqrt, pi, sin, cos, abs, tan, arctan
 from numba import jit
 
+from pandoramoon.grids import grid_time
+
+
+# Largest number of time stamps over which ellipse_inplace advances the orbital
+# phase by rotation before it is evaluated exactly again
+ANCHOR_INTERVAL = 256
+
 
 @jit(cache=True, nopython=True, fastmath=True, parallel=False)
 def ellipse(
     a, per, tau, Omega, i, time, x_bary, mass_ratio, b_bary
 ):
     """2D x-y Kepler solver without eccentricity"""
+    return ellipse_inplace(
+        a, per, tau, Omega, i, time, x_bary, mass_ratio, b_bary,
+        np.empty(len(x_bary)), np.empty(len(x_bary)), np.empty(len(x_bary)),
+        np.empty(len(x_bary))
+    )
+
 
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_single_value(a, per, tau, Omega, i, t, x_bary, mass_ratio, b_bary):
+    """Same as ellipse, but for a single time stamp `t` and barycenter `x_bary`"""
     O = Omega / 180 * pi
     i = i / 180 * pi
-    xm = np.empty(len(time))
-    ym = xm.copy()
-    xp = xm.copy()
-    yp = xm.copy()
     a_planet = (a * mass_ratio) / (1 + mass_ratio)
     a_moon = a - a_planet
-    k = pi * (time - tau * per) / per
+    k = pi * (t - tau * per) / per
     cos_Q = cos(2 * k)
     sin_Q = sin(2 * k)
     vector_x = cos(O) * cos_Q - sin(O) * sin_Q * cos(i)
@@ -30,15 +42,9 @@ def ellipse(
 
 
 @jit(cache=True, nopython=True, fastmath=True, parallel=False)
-def ellipse_ecc(a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary):
-    """2D x-y Kepler solver WITH eccentricity"""
-
-    M = (2 * pi / per) * (time - (tau * per))
-    flip = False
-    M = M - (np.floor(M / (2 * pi)) * 2 * pi)
-    if M.any() > pi:
-        M = 2 * pi - M
-        flip = True
+def kepler_solver(M, e):
+    """Eccentric anomaly for mean anomaly M (float or array) and eccentricity e.
+    Closed-form starter plus three correction terms"""
     alpha = (3 * pi ** 2 + 1.6 * pi * (pi - abs(M)) / (1 + e)) / (pi ** 2 - 6)
     d = 3 * (1 - e) + alpha * e
     r1 = 3 * alpha * d * (d - 1 + e) * M + M ** 3
@@ -50,9 +56,54 @@ def ellipse_ecc(a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary):
     f2 = e * sin(n)
     g = -f0 / (f1 - 0.5 * f0 * f2 / f1)
     h = -f0 / (f1 + 0.5 * g * f2 + (g ** 2) * (1 - f1) / 6)
-    k = n - f0 / (f1 + 0.5 * h * f2 + h ** 2 * (1 - f1) / 6 + h ** 3 * (-f2) / 24)
-    if flip:
-        k = 2 * pi - k
+    return n - f0 / (f1 + 0.5 * h * f2 + h ** 2 * (1 - f1) / 6 + h ** 3 * (-f2) / 24)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_ecc(a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary):
+    """2D x-y Kepler solver WITH eccentricity"""
+
+    # Time grid descriptor: Generate the time stamps on the fly
+    if isinstance(time, tuple):
+        return ellipse_ecc_inplace(
+            a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary,
+            np.empty(len(x_bary)), np.empty(len(x_bary)), np.empty(len(x_bary)),
+            np.empty(len(x_bary))
+        )
+    M = (2 * pi / per) * (time - (tau * per))
+    M = M - (np.floor(M / (2 * pi)) * 2 * pi)
+
+    # The solver is accurate in [0, pi]: Mirror, using E(2 pi - M) = 2 pi - E(M)
+    flip = M > pi
+    M = np.where(flip, 2 * pi - M, M)
+    k = kepler_solver(M, e)
+    k = np.where(flip, 2 * pi - k, k)
+    r = -(1 - e * cos(k))
+
+    wf = (w / 180 * pi) + (arctan(sqrt((1 + e) / (1 - e)) * tan(k / 2)) * 2)
+    v = sin(wf) * cos((i / 180 * pi))
+    O = Omega / 180 * pi
+    vector_x = (cos(O) * cos(wf) - sin(O) * v) * r
+    vector_y = (sin(O) * cos(wf) + cos(O) * v) * r
+
+    a_planet = (a * mass_ratio) / (1 + mass_ratio)
+    a_moon = a - a_planet
+    xm = +vector_x * a_moon + x_bary
+    ym = +vector_y * a_moon + b_bary
+    xp = -vector_x * a_planet + x_bary
+    yp = -vector_y * a_planet + b_bary
+    return xm, ym, xp, yp
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_ecc_single_value(a, per, e, tau, Omega, w, i, t, mass_ratio, x_bary, b_bary):
+    """Same as ellipse_ecc, but for a single time stamp `t` and barycenter `x_bary`"""
+    M = (2 * pi / per) * (t - (tau * per))
+    M = M - (np.floor(M / (2 * pi)) * 2 * pi)
+    if M > pi:
+        k = 2 * pi - kepler_solver(2 * pi - M, e)
+    else:
+        k = kepler_solver(M, e)
     r = -(1 - e * cos(k))
 
     wf = (w / 180 * pi) + (arctan(sqrt((1 + e) / (1 - e)) * tan(k / 2)) * 2)
@@ -67,4 +118,258 @@ def ellipse_ecc(a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary):
     ym = +vector_y * a_moon + b_bary
     xp = -vector_x * a_planet + x_bary
     yp = -vector_y * a_planet + b_bary
-    return xm, ym, xp, yp
\ No newline at end of file
+    return xm, ym, xp, yp
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def uniform_time_step(time, idx, epoch, first):
+    """Step time[idx + 1] - time[idx] if the next two steps are equal within the
+    rounding of the time stamps, else 0. For descriptors from timegrid_descriptor
+    and segmented grids, the step of the epoch (or cadence) at the read position
+    (epoch, first) of grid_time"""
+    if isinstance(time, tuple):
+        if idx - first + 2 >= time[2][epoch]:
+            return 0.
+        if len(time) == 4:
+            return time[1][epoch] / time[2][epoch]
+        return time[1][epoch]
+    if idx + 2 >= len(time):
+        return 0.
+    step = time[idx + 1] - time[idx]
+    if abs(time[idx + 2] - time[idx] - 2 * step) > uniform_tolerance(time[idx], step):
+        return 0.
+    return step
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def uniform_tolerance(t, step):
+    """Deviation from a uniform time grid which is attributed to rounding"""
+    return 1e-9 * abs(step) + 1e-15 * abs(t)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_inplace(
+    a, per, tau, Omega, i, time, x_bary, mass_ratio, b_bary, xm, ym, xp, yp
+):
+    """Same as ellipse, but writes into the preallocated arrays xm, ym, xp, yp.
+    On uniform segments of the time grid, the orbital phase is advanced by a
+    rotation with the phase step (angle addition) instead of sin and cos per
+    time stamp. The phase is evaluated exactly at the start of each segment,
+    every ANCHOR_INTERVAL time stamps, and wherever the grid is not uniform"""
+    O = Omega / 180 * pi
+    cos_O = cos(O)
+    sin_O = sin(O)
+    cos_i = cos(i / 180 * pi)
+    a_planet = (a * mass_ratio) / (1 + mass_ratio)
+    a_moon = a - a_planet
+    cos_Q = 1.
+    sin_Q = 0.
+    cos_D = 1.
+    sin_D = 0.
+    t_anchor = 0.
+    step = 0.
+    steps = ANCHOR_INTERVAL
+    epoch = 0
+    first = 0
+    for idx in range(len(x_bary)):
+        t, epoch, first = grid_time(time, idx, epoch, first)
+        steps += 1
+        if (
+            steps >= ANCHOR_INTERVAL
+            or abs(t - (t_anchor + steps * step)) > uniform_tolerance(t, step)
+        ):
+            k = pi * (t - tau * per) / per
+            cos_Q = cos(2 * k)
+            sin_Q = sin(2 * k)
+            t_anchor = t
+            steps = 0
+            step = uniform_time_step(time, idx, epoch, first)
+            if step == 0:
+                steps = ANCHOR_INTERVAL  # Not uniform: Evaluate the next one exactly
+            else:
+                cos_D = cos(2 * pi * step / per)
+                sin_D = sin(2 * pi * step / per)
+        else:
+            cos_Q, sin_Q = cos_Q * cos_D - sin_Q * sin_D, sin_Q * cos_D + cos_Q * sin_D
+        vector_x = cos_O * cos_Q - sin_O * sin_Q * cos_i
+        vector_y = sin_O * cos_Q + cos_O * sin_Q * cos_i
+        xm[idx] = +vector_x * a_moon + x_bary[idx]
+        ym[idx] = +vector_y * a_moon + b_bary
+        xp[idx] = -vector_x * a_planet + x_bary[idx]
+        yp[idx] = -vector_y * a_planet + b_bary
+    return xm, ym, xp, yp
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_ecc_inplace(
+    a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary, xm, ym, xp, yp
+):
+    """Same as ellipse_ecc, but writes into the preallocated arrays xm, ym, xp, yp.
+    The orientation is computed once, so that each time stamp needs one sin and
+    cos besides the Kepler solver"""
+    orientation = orbit_orientation(Omega, w, i)
+    epoch = 0
+    first = 0
+    for idx in range(len(x_bary)):
+        t, epoch, first = grid_time(time, idx, epoch, first)
+        M = (2 * pi / per) * (t - (tau * per))
+        M = M - (np.floor(M / (2 * pi)) * 2 * pi)
+        if M > pi:
+            E = 2 * pi - kepler_solver(2 * pi - M, e)
+        else:
+            E = kepler_solver(M, e)
+        xm[idx], ym[idx], xp[idx], yp[idx] = ellipse_ecc_position(
+            a, e, cos(E), sin(E), mass_ratio, x_bary[idx], b_bary, orientation
+        )
+    return xm, ym, xp, yp
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def create_kepler_cache(dim_m=128, dim_e=48, e_max=0.95):
+    """2D Cache of the eccentric anomaly E(M, e) for 0 <= M <= pi and
+    0 <= e <= e_max. Other M follow from the symmetry E(2 pi - M) = 2 pi - E(M).
+    The M grid is uniform in sqrt(M / pi), dense towards periapsis where E(M) is
+    steep at high e. Read with read_kepler_cache_single_value, which refines the
+    bilinear interpolation, so that the table can be coarse"""
+    ms = pi * np.linspace(0, 1, dim_m) ** 2
+    es = np.linspace(0, e_max, dim_e)
+    Es = np.empty((dim_e, dim_m))
+    for idx in range(dim_e):
+        e = es[idx]
+        E = kepler_solver(ms, e)
+        for step in range(2):  # Newton polishing to machine precision
+            E = E - (E - e * sin(E) - ms) / (1 - e * cos(E))
+        Es[idx] = E
+    return (Es, ms, es)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def kepler_cache_covers(e, kepler_cache):
+    """True if the eccentricity e is within the e range of the cache"""
+    es = kepler_cache[2]
+    return e <= es[-1]
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def kepler_cache_index(e, kepler_cache):
+    """Index of the lower neighbor row in e, and the weight of the upper row"""
+    es = kepler_cache[2]
+    position = e / (es[1] - es[0])
+    idx_e = min(int(position), len(es) - 2)
+    return idx_e, position - idx_e
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def read_kepler_cache_single_value(M, e, idx_e, ratio_e, Es):
+    """cos and sin of the eccentric anomaly for mean anomaly M, from the
+    bilinear interpolation in the cache and two Halley steps. The steps update
+    sin and cos with their Taylor series, so that only the start needs sin and
+    cos. The error is below 1e-9 for the default cache up to e = 0.95"""
+    M = M - np.floor(M / (2 * pi)) * 2 * pi
+    mirror = M > pi
+    if mirror:
+        M = 2 * pi - M
+    dim_m = Es.shape[1]
+    position = sqrt(M / pi) * (dim_m - 1)
+    idx_m = min(int(position), dim_m - 2)
+    ratio_m = position - idx_m
+    E = (
+        (1 - ratio_e) * ((1 - ratio_m) * Es[idx_e, idx_m] + ratio_m * Es[idx_e, idx_m + 1])
+        + ratio_e * ((1 - ratio_m) * Es[idx_e + 1, idx_m] + ratio_m * Es[idx_e + 1, idx_m + 1])
+    )
+    sin_E = sin(E)
+    cos_E = cos(E)
+    for step in range(2):
+        f0 = E - e * sin_E - M
+        f1 = 1 - e * cos_E
+        delta = -f0 / (f1 + 0.5 * f0 * e * sin_E / f1)
+        d2 = 0.5 * delta * delta
+        d3 = d2 * delta / 3
+        d4 = d3 * delta / 4
+        d5 = d4 * delta / 5
+        sin_E, cos_E = (
+            sin_E + (delta - d3 + d5) * cos_E - (d2 - d4) * sin_E,
+            cos_E - (delta - d3 + d5) * sin_E - (d2 - d4) * cos_E,
+        )
+        E += delta
+    if mirror:
+        sin_E = -sin_E
+    return cos_E, sin_E
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def orbit_orientation(Omega, w, i):
+    """Projection of the orbit plane coordinates (X towards periapsis, Y) onto
+    the sky, with the orientation of ellipse_ecc (angles in deg)"""
+    O = Omega / 180 * pi
+    w = w / 180 * pi
+    cos_i = cos(i / 180 * pi)
+    return (
+        cos(O) * cos(w) - sin(O) * cos_i * sin(w),
+        -cos(O) * sin(w) - sin(O) * cos_i * cos(w),
+        sin(O) * cos(w) + cos(O) * cos_i * sin(w),
+        -sin(O) * sin(w) + cos(O) * cos_i * cos(w),
+    )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_ecc_cached_single_value(
+    a, per, e, tau, t, mass_ratio, x_bary, b_bary, orientation, idx_e, ratio_e, Es
+):
+    """Same as ellipse_ecc_single_value, with the eccentric anomaly from the
+    Kepler cache and the orientation from orbit_orientation: One sin and cos
+    per time stamp. M is mirrored into [0, pi] like in ellipse_ecc"""
+    M = (2 * pi / per) * (t - (tau * per))
+    cos_E, sin_E = read_kepler_cache_single_value(M, e, idx_e, ratio_e, Es)
+    return ellipse_ecc_position(
+        a, e, cos_E, sin_E, mass_ratio, x_bary, b_bary, orientation
+    )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_ecc_position(a, e, cos_E, sin_E, mass_ratio, x_bary, b_bary, orientation):
+    """Positions xm, ym, xp, yp for the eccentric anomaly E (given as cos E and
+    sin E) and the orientation from orbit_orientation"""
+    X = cos_E - e
+    Y = sqrt(1 - e ** 2) * sin_E
+    vector_x = -(orientation[0] * X + orientation[1] * Y)
+    vector_y = -(orientation[2] * X + orientation[3] * Y)
+    a_planet = (a * mass_ratio) / (1 + mass_ratio)
+    a_moon = a - a_planet
+    xm = +vector_x * a_moon + x_bary
+    ym = +vector_y * a_moon + b_bary
+    xp = -vector_x * a_planet + x_bary
+    yp = -vector_y * a_planet + b_bary
+    return xm, ym, xp, yp
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_ecc_cached_inplace(
+    a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary, kepler_cache,
+    xm, ym, xp, yp
+):
+    """Same as ellipse_ecc_inplace, with the Kepler cache from create_kepler_cache"""
+    orientation = orbit_orientation(Omega, w, i)
+    idx_e, ratio_e = kepler_cache_index(e, kepler_cache)
+    Es = kepler_cache[0]
+    epoch = 0
+    first = 0
+    for idx in range(len(x_bary)):
+        t, epoch, first = grid_time(time, idx, epoch, first)
+        xm[idx], ym[idx], xp[idx], yp[idx] = ellipse_ecc_cached_single_value(
+            a, per, e, tau, t, mass_ratio, x_bary[idx], b_bary,
+            orientation, idx_e, ratio_e, Es
+        )
+    return xm, ym, xp, yp
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def ellipse_ecc_cached(
+    a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary, kepler_cache
+):
+    """Same as ellipse_ecc, with the Kepler cache from create_kepler_cache"""
+    return ellipse_ecc_cached_inplace(
+        a, per, e, tau, Omega, w, i, time, mass_ratio, x_bary, b_bary, kepler_cache,
+        np.empty(len(x_bary)), np.empty(len(x_bary)), np.empty(len(x_bary)),
+        np.empty(len(x_bary))
+    )
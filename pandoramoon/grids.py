@@ -1,6 +1,7 @@
 import numpy as np
 from numpy import sqrt, pi, cos, arcsin, empty
 from numba import jit
+from hashlib import sha1
 
 
 @jit(cache=True, nopython=True, fastmath=True, parallel=False)
@@ -36,9 +37,202 @@ def timegrid(t0_bary, epochs, epoch_duration, cadences_per_day, epoch_distance,
 
 
 @jit(cache=True, nopython=True, fastmath=True, parallel=False)
-def x_bary_grid(
-    time, a_bary, per_bary, t0_bary, t0_bary_offset, epoch_distance, ecc_bary, w_bary
+def timegrid_descriptor(
+    t0_bary, epochs, epoch_duration, cadences_per_day, epoch_distance, supersampling_factor
 ):
+    """Compact form of timegrid(): a tuple (t_mids, steps, counts) with the mid-time,
+    the time step and the number of time stamps of each epoch. Accepted as `time`
+    by pandora() and its stages, which generate the time stamps on the fly"""
+    t_mids = t0_bary + epoch_distance * np.arange(epochs)
+    cadences = int(cadences_per_day * int(supersampling_factor) * epoch_duration)
+    steps = np.full(epochs, epoch_duration / (cadences - 1))
+    counts = np.full(epochs, cadences)
+    return (t_mids, steps, counts)
+
+
+def segmented_timegrid(segments):
+    """Time grid of several data sets, e.g. from different instruments, each with
+    its own exposure time and supersampling factor. `segments` is a list of
+    (time, exposure_time, supersampling_factor) with the mid-exposure times of the
+    cadences of each data set. Returns a tuple (cadence_times, exposure_times,
+    supersampling_factors, first_samples) with one value per cadence, accepted as
+    `time` by pandora() and its stages. Each cadence is sampled at the centers of
+    supersampling_factor equal parts of its exposure, and its flux is the mean."""
+    cadence_times = []
+    exposure_times = []
+    supersampling_factors = []
+    for time, exposure_time, supersampling_factor in segments:
+        time = np.asarray(time, dtype=np.float64)
+        cadence_times.append(time)
+        exposure_times.append(np.full(len(time), float(exposure_time)))
+        supersampling_factors.append(np.full(len(time), max(int(supersampling_factor), 1)))
+    supersampling_factors = np.concatenate(supersampling_factors).astype(np.int64)
+    first_samples = np.zeros(len(supersampling_factors), dtype=np.int64)
+    first_samples[1:] = np.cumsum(supersampling_factors)[:-1]
+    return (
+        np.concatenate(cadence_times),
+        np.concatenate(exposure_times),
+        supersampling_factors,
+        first_samples,
+    )
+
+
+def grid_hash(time):
+    """Hash of a time grid: of the time stamps, or of the arrays of a descriptor"""
+    digest = sha1()
+    for array in time if isinstance(time, tuple) else (time,):
+        array = np.ascontiguousarray(array)
+        digest.update(repr((array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def grid_length(time):
+    """Number of time stamps of a time array, a descriptor from timegrid_descriptor
+    or a segmented grid from segmented_timegrid"""
+    if isinstance(time, tuple):
+        if len(time) == 4:
+            if len(time[0]) == 0:
+                return 0
+            return int(time[3][-1] + time[2][-1])
+        return int(np.sum(time[2]))
+    return len(time)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def grid_cadences(time, supersampling_factor):
+    """Number of cadences after the supersampling downconversion"""
+    if isinstance(time, tuple):
+        if len(time) == 4:
+            return len(time[0])
+    if supersampling_factor > 1:
+        return int(grid_length(time) / supersampling_factor)
+    return grid_length(time)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def grid_segmented(time):
+    """True for a segmented grid from segmented_timegrid"""
+    if isinstance(time, tuple):
+        if len(time) == 4:
+            return True
+    return False
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def grid_segments(time):
+    """Supersampling factors and first time stamps of the cadences of a segmented
+    grid from segmented_timegrid, empty for other time grids"""
+    if isinstance(time, tuple):
+        if len(time) == 4:
+            return time[2], time[3]
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def grid_cadence_samples(time, supersampling_factor, cadence):
+    """Index of the first time stamp of a cadence. For cadence == number of
+    cadences, the number of time stamps"""
+    if isinstance(time, tuple):
+        if len(time) == 4:
+            if cadence == len(time[0]):
+                return grid_length(time)
+            return time[3][cadence]
+    if cadence == grid_cadences(time, supersampling_factor):
+        return grid_length(time)
+    return cadence * max(supersampling_factor, 1)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def grid_chunk(time, first_cadence, last_cadence, start, end):
+    """Part of a time grid with the cadences first_cadence to last_cadence - 1 and
+    the time stamps start to end - 1, in a form which pandora() accepts: A view for
+    time arrays, a dense array for descriptors, a segmented grid for segmented
+    grids"""
+    if isinstance(time, tuple):
+        if len(time) == 4:
+            return (
+                time[0][first_cadence:last_cadence],
+                time[1][first_cadence:last_cadence],
+                time[2][first_cadence:last_cadence],
+                time[3][first_cadence:last_cadence] - start,
+            )
+        values = np.empty(end - start)
+        epoch = 0
+        first = 0
+        for idx in range(start, end):
+            values[idx - start], epoch, first = grid_time(time, idx, epoch, first)
+        return values
+    return time[start:end]
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def epoch_chunks(time, supersampling_factor, t0_bary, per_bary, max_cadences):
+    """Cadence boundaries of chunks of a time grid, for the parallel evaluation:
+    A new chunk starts with each planet epoch, and after max_cadences cadences.
+    Returns an array of the first cadence of each chunk, and the number of
+    cadences as the last element"""
+    cadences = grid_cadences(time, supersampling_factor)
+    boundaries = np.empty(cadences + 1, dtype=np.int64)
+    chunks = 0
+    epoch_last = 0
+    epoch = 0
+    first = 0
+    for cadence in range(cadences):
+        idx = grid_cadence_samples(time, supersampling_factor, cadence)
+        t, epoch, first = grid_time(time, idx, epoch, first)
+        epoch_now = int(np.floor((t - t0_bary) / per_bary + 0.5))
+        if (
+            cadence == 0
+            or epoch_now != epoch_last
+            or cadence - boundaries[chunks - 1] >= max_cadences
+        ):
+            boundaries[chunks] = cadence
+            chunks += 1
+        epoch_last = epoch_now
+    boundaries[chunks] = cadences
+    return boundaries[:chunks + 1]
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def grid_time(time, idx, epoch, first):
+    """Time stamp `idx` of a time array, a descriptor from timegrid_descriptor or
+    a segmented grid. For descriptors, `epoch` and `first` (index of its first
+    time stamp) are the epoch (or cadence) of the previous read, which is advanced
+    and returned, so that sequential reads need no search: Start with
+    epoch = first = 0."""
+    if isinstance(time, tuple):
+        if len(time) == 4:
+            cadence_times, exposure_times, supersampling_factors, first_samples = time
+            while idx - first >= supersampling_factors[epoch]:
+                epoch += 1
+                first = first_samples[epoch]
+            samples = supersampling_factors[epoch]
+            position = (idx - first + 0.5) / samples - 0.5
+            return cadence_times[epoch] + position * exposure_times[epoch], epoch, first
+        t_mids, steps, counts = time
+        while idx - first >= counts[epoch]:
+            first += counts[epoch]
+            epoch += 1
+        position = idx - first - 0.5 * (counts[epoch] - 1)
+        return t_mids[epoch] + position * steps[epoch], epoch, first
+    return time[idx], epoch, first
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def expand_timegrid(time):
+    """Dense time array of a descriptor from timegrid_descriptor"""
+    values = np.empty(grid_length(time))
+    epoch = 0
+    first = 0
+    for idx in range(len(values)):
+        values[idx], epoch, first = grid_time(time, idx, epoch, first)
+    return values
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def transit_duration(a_bary, per_bary, ecc_bary, w_bary):
     # Planetary transit duration at b=0 equals the width of the star
     # Formally correct would be: (R_star+r_planet) for the transit duration T1-T4
     # Here, however, we need points where center of planet is on stellar limb
@@ -50,15 +244,55 @@ def x_bary_grid(
     # Subtract (w_bary - 90) to match batman and PyTransit coordinate system
     if ecc_bary > 0:
         tdur /= 1 / sqrt(1 - ecc_bary ** 2) * (1 + ecc_bary * cos((w_bary - 90) / 180 * pi))
+    return tdur
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def x_bary_single_value(t, tdur, per_bary, t0_bary, t0_shift_planet, epoch_distance):
+    """Barycenter x position for one time stamp. Used by x_bary_grid and by the
+    fused kernels which work cadence by cadence"""
+    epoch = int((t - t0_bary) / per_bary + 0.5)
+    return (
+        (2 * (t - (t0_bary + epoch_distance * epoch))) / tdur
+        - t0_shift_planet
+        - (((per_bary - epoch_distance) * epoch) / (tdur / 2))
+    )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def x_bary_grid(
+    time, a_bary, per_bary, t0_bary, t0_bary_offset, epoch_distance, ecc_bary, w_bary
+):
+    x_bary = np.empty(grid_length(time))
+    return x_bary_grid_inplace(
+        time, a_bary, per_bary, t0_bary, t0_bary_offset, epoch_distance, ecc_bary,
+        w_bary, x_bary
+    )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def x_bary_grid_inplace(
+    time, a_bary, per_bary, t0_bary, t0_bary_offset, epoch_distance, ecc_bary, w_bary,
+    x_bary
+):
+    """Same as x_bary_grid, but writes into the preallocated array `x_bary`"""
+    tdur = transit_duration(a_bary, per_bary, ecc_bary, w_bary)
 
     # t0_bary_offset in [days] ==> convert to x scale (i.e. 0.5 transit dur radius)
     t0_shift_planet = t0_bary_offset / (tdur / 2)
-    x_bary = np.empty(len(time))
-    for idx in range(len(time)):
-        epoch = int((time[idx] - t0_bary) / per_bary + 0.5)
-        x_bary[idx] = (
-            (2 * (time[idx] - (t0_bary + epoch_distance * epoch))) / tdur
-            - t0_shift_planet
-            - (((per_bary - epoch_distance) * epoch) / (tdur / 2))
+    epoch = 0
+    first = 0
+    for idx in range(len(x_bary)):
+        t, epoch, first = grid_time(time, idx, epoch, first)
+        x_bary[idx] = x_bary_single_value(
+            t, tdur, per_bary, t0_bary, t0_shift_planet, epoch_distance
         )
     return x_bary
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def window_limit(a_moon, ecc_moon, r_planet, r_moon):
+    """Largest barycenter distance |x_bary| at which planet or moon can still
+    overlap the star. The moon is at most a_moon * (1 + ecc_moon) away from
+    the barycenter, the planet is always closer."""
+    return 1 + a_moon * (1 + ecc_moon) + max(r_planet, r_moon)
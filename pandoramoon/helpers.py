@@ -7,13 +7,35 @@ from numba import jit
 def resample(arr, factor):
     out_samples = int(len(arr) / factor)
     out_arr = np.ones(out_samples)
-    for idx in range(out_samples):
+    return resample_inplace(arr, factor, out_arr)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def resample_inplace(arr, factor, out_arr):
+    """Same as resample, but writes into the preallocated array `out_arr`"""
+    for idx in range(len(out_arr)):
         start = idx * factor
         end = start + factor - 1
         out_arr[idx] = np.mean(arr[start:end])
     return out_arr
 
 
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def resample_segments(arr, supersampling_factors, first_samples):
+    """Mean of the samples of each cadence of a segmented time grid"""
+    out_arr = np.ones(len(supersampling_factors))
+    return resample_segments_inplace(arr, supersampling_factors, first_samples, out_arr)
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def resample_segments_inplace(arr, supersampling_factors, first_samples, out_arr):
+    """Same as resample_segments, but writes into the preallocated array `out_arr`"""
+    for idx in range(len(out_arr)):
+        start = first_samples[idx]
+        out_arr[idx] = np.mean(arr[start:start + supersampling_factors[idx]])
+    return out_arr
+
+
 @jit(cache=True, nopython=True, fastmath=True, parallel=False)
 def ld_convert(q1, q2):
     u1 = 2 * np.sqrt(q1) * q2
@@ -24,4 +46,29 @@ def ld_convert(q1, q2):
 def ld_invert(u1, u2):
     q1 = (u1 + u2)**2
     q2 = u1 / (2 * (u1 + u2))
-    return q1, q2
\ No newline at end of file
+    return q1, q2
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def gauss_legendre(n):
+    """Nodes and weights of the n-point Gauss-Legendre quadrature on [-1, 1].
+    The weights sum to 2"""
+    nodes = np.empty(n)
+    weights = np.empty(n)
+    for idx in range((n + 1) // 2):
+        x = np.cos(np.pi * (idx + 0.75) / (n + 0.5))  # Tricomi starting value
+        for step in range(100):
+            p0 = 1.
+            p1 = x
+            for order in range(2, n + 1):
+                p0, p1 = p1, ((2 * order - 1) * x * p1 - (order - 1) * p0) / order
+            derivative = n * (x * p1 - p0) / (x ** 2 - 1)
+            delta = p1 / derivative
+            x -= delta
+            if abs(delta) < 1e-15:
+                break
+        nodes[idx] = -x
+        nodes[n - 1 - idx] = x
+        weights[idx] = 2 / ((1 - x ** 2) * derivative ** 2)
+        weights[n - 1 - idx] = weights[idx]
+    return nodes, weights
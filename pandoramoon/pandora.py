@@ -1,17 +1,46 @@
 import numpy as np
 from numpy import sqrt, pi, arcsin, cos, degrees
-from numba import jit
+from numba import jit, prange
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from os import path
+from concurrent.futures import ThreadPoolExecutor
 
 # Pandora
-from pandoramoon.eclipse import eclipse
-from pandoramoon.ellipse import ellipse, ellipse_ecc
-from pandoramoon.occult import occult, occult_small, occult_hybrid, create_occult_cache, read_occult_cache
-from pandoramoon.helpers import resample
-from pandoramoon.grids import timegrid, x_bary_grid
+from pandoramoon.eclipse import eclipse_single_value, eclipses_occur, eclipse_candidates
+from pandoramoon.eclipse import eclipse_ratios, eclipsed_flux, eclipse_buffers
+from pandoramoon.ellipse import ellipse_single_value, ellipse_ecc_single_value
+from pandoramoon.ellipse import ellipse_inplace, ellipse_ecc_inplace
+from pandoramoon.ellipse import ellipse_ecc_cached_inplace, create_kepler_cache
+from pandoramoon.ellipse import ellipse_ecc_cached_single_value, kepler_cache_covers
+from pandoramoon.ellipse import kepler_cache_index, orbit_orientation
+from pandoramoon.occult import occult_small, occult_hybrid, occult_components
+from pandoramoon.occult import occult_hybrid_exact, occult_hybrid_combine
+from pandoramoon.occult import occult_small_inplace, occult_hybrid_inplace, occult_scratch
+from pandoramoon.occult import read_cache_inplace, spline_cache_dim
+from pandoramoon.occult import occult_small_single_value, occult_hybrid_coefficients, occult_hybrid_single_value
+from pandoramoon.occult import read_occult_cache_index, read_cache_single_value, cache_arrays
+from pandoramoon.occult import read_cache, occult_cache_covers, cache_row
+from pandoramoon.occult import read_spline_cache_row_single_value
+from pandoramoon.helpers import resample, resample_inplace, gauss_legendre
+from pandoramoon.helpers import resample_segments, resample_segments_inplace
+from pandoramoon.cache_store import open_occult_spline_cache, load_occult_cache
+from pandoramoon.grids import timegrid, timegrid_descriptor, x_bary_grid, transit_duration, x_bary_single_value, window_limit
+from pandoramoon.grids import x_bary_grid_inplace, grid_length, grid_time, grid_cadences
+from pandoramoon.grids import grid_segments, grid_segmented, grid_chunk, grid_cadence_samples, epoch_chunks, grid_hash
+
+
+# Model parameters in the order of the pandora() arguments
+PARAMETERS = (
+    "u1", "u2", "R_star",
+    "per_bary", "a_bary", "r_planet", "b_bary", "w_bary", "ecc_bary", "t0_bary",
+    "t0_bary_offset", "M_planet",
+    "r_moon", "per_moon", "tau_moon", "Omega_moon", "i_moon", "ecc_moon", "w_moon",
+    "M_moon",
+    "epoch_distance", "supersampling_factor", "occult_small_threshold",
+    "hill_sphere_threshold", "numerical_grid",
+)
 
 
 class model_params(object):
@@ -54,6 +83,15 @@ class model_params(object):
         self.numerical_grid = 25
         self.time = None
 
+    def pack(self, out=None):
+        """Parameters as a float64 array in the order of PARAMETERS, for
+        pandora_packed() and as a row of pandora_batch(). Fills `out` if given."""
+        if out is None:
+            out = np.empty(len(PARAMETERS))
+        for idx, name in enumerate(PARAMETERS):
+            out[idx] = getattr(self, name)
+        return out
+
 
 class time(object):
     def __init__(self, params):
@@ -74,9 +112,19 @@ class time(object):
             self.supersampling_factor
         )
 
+    def descriptor(self):
+        return timegrid_descriptor(
+            self.t0_bary,
+            self.epochs,
+            self.epoch_duration,
+            self.cadences_per_day,
+            self.epoch_distance,
+            self.supersampling_factor
+        )
+
 
 class moon_model(object):
-    def __init__(self, params):
+    def __init__(self, params, cache=None):
 
         # Star parameters
         self.u1 = params.u1
@@ -111,7 +159,42 @@ class moon_model(object):
         self.hill_sphere_threshold = params.hill_sphere_threshold
         self.numerical_grid = params.numerical_grid
         self.time = params.time
-        self.cache = create_occult_cache(self.u1, self.u2, dim=300)
+        if cache is None:
+            cache = open_occult_spline_cache()
+        elif isinstance(cache, str):
+            cache = load_occult_cache(cache)  # Name from share_occult_cache
+        self.cache = cache
+        self.kepler_cache = create_kepler_cache()
+        self.incremental = None
+        self.result = None
+
+    def update(self, **params):
+        """Changes model parameters in place, e.g. model.update(r_moon=0.04), and
+        keeps the caches. A cache for fixed limb darkening from create_occult_cache
+        is replaced by the spline cache when u1 or u2 change."""
+        for name in params:
+            if name not in PARAMETERS:
+                raise ValueError("Unknown model parameter: " + name)
+        limb_darkening = (self.u1, self.u2)
+        for name, value in params.items():
+            setattr(self, name, value)
+        if len(self.cache) == 3 and (self.u1, self.u2) != limb_darkening:
+            self.cache = open_occult_spline_cache()
+            self.incremental = None
+        return self
+
+    def evaluate(self, time):
+        """Result of the model for the current parameters. The model is evaluated
+        on first access to one of its arrays. Calls with unchanged parameters and
+        time grid return the same result."""
+        values = tuple(getattr(self, name) for name in PARAMETERS)
+        key = (values, grid_hash(time))
+        if self.result is None or self.result.key != key:
+            if self.incremental is None or self.incremental_key != key[1]:
+                self.incremental = incremental_model(time, self.cache, self.kepler_cache)
+                self.incremental_key = key[1]
+            self.result = model_result(key, self.incremental, values)
+        return self.result
 
     def video(
         self,
@@ -122,48 +205,15 @@ class moon_model(object):
         moon_color="black",
         ld_circles=100,
     ):
-        (
-            self.flux_planet,
-            self.flux_moon,
-            self.flux_total,
-            self.px,
-            self.py,
-            self.mx,
-            self.my
-        ) = pandora(
-            self.u1,
-            self.u2,
-            self.R_star,
-
-            # Planet parameters
-            self.per_bary,
-            self.a_bary,
-            self.r_planet,
-            self.b_bary,
-            self.w_bary,
-            self.ecc_bary,
-            self.t0_bary,
-            self.t0_bary_offset,
-            self.M_planet,
-
-            # Moon parameters
-            self.r_moon,
-            self.per_moon,
-            self.tau_moon,
-            self.Omega_moon,
-            self.i_moon,
-            self.ecc_moon,
-            self.w_moon,
-            self.M_moon,
+        result = self.evaluate(time)
+        self.flux_planet = result.flux_planet.copy()
+        self.flux_moon = result.flux_moon.copy()
+        self.flux_total = result.flux_total.copy()
+        self.px = result.px.copy()
+        self.py = result.py.copy()
+        self.mx = result.mx.copy()
+        self.my = result.my.copy()
 
-            # Other model parameters
-            self.epoch_distance,
-            self.supersampling_factor,
-            self.occult_small_threshold,
-            self.hill_sphere_threshold,
-            self.numerical_grid,
-            time
-        )
         # Build video with matplotlib
         fig = plt.figure(figsize=(5, 5))
         axes = fig.add_subplot(111)
@@ -230,82 +280,635 @@ class moon_model(object):
 
 
     def light_curve(self, time):
-        flux_planet, flux_moon, flux_total, px, py, mx, my = pandora(
-            self.u1,
-            self.u2,
-            self.R_star,
+        result = self.evaluate(time)
+        return result.flux_total.copy(), result.flux_planet.copy(), result.flux_moon.copy()
 
-            # Planet parameters
-            self.per_bary,
-            self.a_bary,
-            self.r_planet,
-            self.b_bary,
-            self.w_bary,
-            self.ecc_bary,
-            self.t0_bary,
-            self.t0_bary_offset,
-            self.M_planet,
+    def coordinates(self, time):
+        result = self.evaluate(time)
+        return result.px.copy(), result.py.copy(), result.mx.copy(), result.my.copy()
 
-            # Moon parameters
-            self.r_moon,
-            self.per_moon,
-            self.tau_moon,
-            self.Omega_moon,
-            self.i_moon,
-            self.ecc_moon,
-            self.w_moon,
-            self.M_moon,
 
-            # Other model parameters
-            self.epoch_distance,
-            self.supersampling_factor,
-            self.occult_small_threshold,
-            self.hill_sphere_threshold,
-            self.numerical_grid,
+class model_result(object):
+    """Fluxes and coordinates from moon_model.evaluate(). All arrays are computed
+    together on first access to one of them. They are shared by all later calls
+    with the same parameters, and therefore read-only."""
+    def __init__(self, key, model, values):
+        self.key = key
+        self.model = model
+        self.values = values
+        self.arrays = None
+
+    def evaluate(self):
+        if self.arrays is None:
+            self.arrays = self.model(*self.values)
+            self.model = None
+            for array in self.arrays:
+                array.setflags(write=False)
+        return self.arrays
+
+    @property
+    def flux_planet(self):
+        return self.evaluate()[0]
+
+    @property
+    def flux_moon(self):
+        return self.evaluate()[1]
+
+    @property
+    def flux_total(self):
+        return self.evaluate()[2]
+
+    @property
+    def px(self):
+        return self.evaluate()[3]
+
+    @property
+    def py(self):
+        return self.evaluate()[4]
+
+    @property
+    def mx(self):
+        return self.evaluate()[5]
+
+    @property
+    def my(self):
+        return self.evaluate()[6]
+
+
+class incremental_model(object):
+    """Evaluates pandora() for a sequence of parameter sets on one time grid.
+    The results of each stage are kept, and a call recomputes only the stages
+    whose inputs changed since the previous call."""
+    def __init__(self, time, cache=None, kepler_cache=None):
+        self.time = time
+        self.cache = cache
+        self.kepler_cache = kepler_cache
+        self.keys = {}
+
+    def __call__(
+        self,
+        u1,
+        u2,
+        R_star,
+        # Planet parameters
+        per_bary,
+        a_bary,
+        r_planet,
+        b_bary,
+        w_bary,
+        ecc_bary,
+        t0_bary,
+        t0_bary_offset,
+        M_planet,
+        # Moon parameters
+        r_moon,
+        per_moon,
+        tau_moon,
+        Omega_moon,
+        i_moon,
+        ecc_moon,
+        w_moon,
+        M_moon,
+        # Other model parameters
+        epoch_distance,
+        supersampling_factor,
+        occult_small_threshold,
+        hill_sphere_threshold,
+        numerical_grid
+    ):
+        """Same parameters and results as pandora(), without time and caches"""
+        u1 = float(u1)
+        u2 = float(u2)
+        R_star = float(R_star)
+        per_bary = float(per_bary)
+        a_bary = float(a_bary)
+        r_planet = float(r_planet)
+        b_bary = float(b_bary)
+        w_bary = float(w_bary)
+        ecc_bary = float(ecc_bary)
+        t0_bary = float(t0_bary)
+        t0_bary_offset = float(t0_bary_offset)
+        M_planet = float(M_planet)
+        r_moon = float(r_moon)
+        per_moon = float(per_moon)
+        tau_moon = float(tau_moon)
+        Omega_moon = float(Omega_moon)
+        i_moon = float(i_moon)
+        ecc_moon = float(ecc_moon)
+        w_moon = float(w_moon)
+        M_moon = float(M_moon)
+        epoch_distance = float(epoch_distance)
+        supersampling_factor = int(supersampling_factor)
+        numerical_grid = int(numerical_grid)
+
+        a_moon = moon_semimajor_axis(per_moon, M_planet, M_moon, R_star)
+        unphysical = unphysical_moon(
+            a_moon, a_bary, per_bary, R_star, M_planet, r_planet, r_moon, hill_sphere_threshold
+        )
+
+        # The key of each stage holds its parameters and the keys of its inputs
+        x_bary_key = (per_bary, a_bary, t0_bary, t0_bary_offset, epoch_distance, ecc_bary, w_bary)
+        if self.keys.get("x_bary") != x_bary_key:
+            self.x_bary = x_bary_grid(
+                self.time,
+                a_bary,
+                per_bary,
+                t0_bary,
+                t0_bary_offset,
+                epoch_distance,
+                ecc_bary,
+                w_bary
+            )
+            self.keys["x_bary"] = x_bary_key
+
+        orbit_key = (x_bary_key, unphysical, b_bary)
+        if not unphysical:
+            orbit_key += (a_moon, per_moon, tau_moon, Omega_moon, i_moon, ecc_moon, w_moon, M_moon / M_planet)
+        if self.keys.get("orbit") != orbit_key:
+            self.xp, self.yp, self.xm, self.ym = orbit_coordinates(
+                a_moon,
+                per_moon,
+                tau_moon,
+                Omega_moon,
+                i_moon,
+                ecc_moon,
+                w_moon,
+                M_moon / M_planet,
+                b_bary,
+                self.time,
+                self.x_bary,
+                unphysical,
+                self.kepler_cache
+            )
+            self.z_planet, self.z_moon = star_distances(
+                self.xp, self.yp, self.xm, self.ym, unphysical
+            )
+            self.keys["orbit"] = orbit_key
+
+        window_key = (x_bary_key, window_limit(a_moon, ecc_moon, r_planet, r_moon))
+        if self.keys.get("window") != window_key:
+            self.window = np.nonzero(np.abs(self.x_bary) < window_key[1])[0]
+            self.keys["window"] = window_key
+
+        planet_key = (orbit_key, window_key, r_planet, u1, u2)
+        if self.keys.get("planet") != planet_key:
+            self.flux_planet = planet_flux(
+                self.z_planet, self.window, r_planet, u1, u2, self.cache
+            )
+            self.keys["planet"] = planet_key
+
+        moon_key = (orbit_key, window_key, r_moon, u1, u2, r_moon < occult_small_threshold)
+        if self.keys.get("moon") != moon_key:
+            self.flux_moon_occulted = moon_flux(
+                self.z_moon, self.window, r_moon, u1, u2, occult_small_threshold, self.cache
+            )
+            self.keys["moon"] = moon_key
+
+        eclipse_key = (moon_key, r_planet, numerical_grid)
+        if self.keys.get("eclipse") != eclipse_key:
+            self.flux_moon = self.flux_moon_occulted.copy()
+            if not unphysical and eclipses_occur(a_moon, ecc_moon, i_moon, r_planet, r_moon):
+                mutual_eclipses(
+                    self.xp,
+                    self.yp,
+                    self.xm,
+                    self.ym,
+                    self.window,
+                    r_planet,
+                    r_moon,
+                    self.flux_moon,
+                    numerical_grid
+                )
+            self.keys["eclipse"] = eclipse_key
+
+        # The kept arrays are returned as copies, so that callers cannot change them
+        flux_total = self.flux_moon + self.flux_planet - 1
+        return (
+            downsample(self.flux_planet.copy(), self.time, supersampling_factor),
+            downsample(self.flux_moon.copy(), self.time, supersampling_factor),
+            downsample(flux_total, self.time, supersampling_factor),
+            self.xp.copy(),
+            self.yp.copy(),
+            self.xm.copy(),
+            self.ym.copy()
+        )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def moon_semimajor_axis(per_moon, M_planet, M_moon, R_star):
+    """Semimajor axis of the moon around the planet [R_star] from Kepler's third law"""
+    G = 6.67408e-11
+    day = 60 * 60 * 24
+    a_moon = (
+        G * (M_planet + M_moon) / (2 * pi / (per_moon * day)) ** 2
+    ) ** (1 / 3)
+    return a_moon / R_star
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def unphysical_moon(
+    a_moon, a_bary, per_bary, R_star, M_planet, r_planet, r_moon, hill_sphere_threshold
+):
+    """Check physical plausibility of a_moon
+    Should be inside [Roche lobe, Hill sphere] plus/minus some user-set margin"""
+    G = 6.67408e-11
+    day = 60 * 60 * 24
+    M_star = ((4 * pi ** 2 / G) * ((a_bary * R_star) ** 3)) / (per_bary * day) ** 2
+    r_hill = a_bary * (M_planet / (3 * M_star)) ** (1 / 3)
+    r_hill_fraction = a_moon / r_hill
+    if r_hill_fraction > hill_sphere_threshold:
+        return True
+
+    # Roche lobe: Not used here, because we don't know densities of planet and moon
+    # Instead of taking density guesses, we just demand a_moon > (R_planet + R_moon)
+    if a_moon < (r_planet + r_moon):
+        return True
+    return False
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def physical_moon(
+    R_star, per_bary, a_bary, r_planet, M_planet, r_moon, per_moon, M_moon, hill_sphere_threshold
+):
+    """True if the moon orbit is plausible, see unphysical_moon. Otherwise, the model
+    functions return a planet-only model. Needs no arrays, e.g. for prior transforms"""
+    a_moon = moon_semimajor_axis(float(per_moon), float(M_planet), float(M_moon), float(R_star))
+    return not unphysical_moon(
+        a_moon,
+        float(a_bary),
+        float(per_bary),
+        float(R_star),
+        float(M_planet),
+        float(r_planet),
+        float(r_moon),
+        hill_sphere_threshold
+    )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def orbit_coordinates(
+    a_moon,
+    per_moon,
+    tau_moon,
+    Omega_moon,
+    i_moon,
+    ecc_moon,
+    w_moon,
+    mass_ratio,
+    b_bary,
+    time,
+    x_bary,
+    unphysical,
+    kepler_cache=None,
+    out=None
+):
+    """Coordinates xp, yp, xm, ym of planet and moon [R_star].
+    Written into the arrays of the tuple `out` = (xp, yp, xm, ym) if given"""
+    if out is None:
+        xp = np.empty(len(x_bary))
+        yp = np.empty(len(x_bary))
+        xm = np.empty(len(x_bary))
+        ym = np.empty(len(x_bary))
+    else:
+        xp, yp, xm, ym = out
+
+    # Unphysical moon orbit: Keep planet, but put moon at far out of transit position
+    if unphysical:
+        bignum = 1e8
+        xp[:] = x_bary
+        yp[:] = b_bary
+        xm[:] = bignum
+        ym[:] = bignum
+    elif ecc_moon == 0:
+        ellipse_inplace(
+            a_moon,
+            per_moon,
+            tau_moon,
+            Omega_moon,
+            i_moon,
+            time,
+            x_bary,
+            mass_ratio,
+            b_bary,
+            xm,
+            ym,
+            xp,
+            yp
+        )
+    elif kepler_cache is not None and kepler_cache_covers(ecc_moon, kepler_cache):
+        ellipse_ecc_cached_inplace(
+            a_moon,
+            per_moon,
+            ecc_moon,
+            tau_moon,
+            Omega_moon,
+            w_moon,
+            i_moon,
+            time,
+            mass_ratio,
+            x_bary,
+            b_bary,
+            kepler_cache,
+            xm,
+            ym,
+            xp,
+            yp
+        )
+    else:
+        ellipse_ecc_inplace(
+            a_moon,
+            per_moon,
+            ecc_moon,
+            tau_moon,
+            Omega_moon,
+            w_moon,
+            i_moon,
             time,
-            self.cache
+            mass_ratio,
+            x_bary,
+            b_bary,
+            xm,
+            ym,
+            xp,
+            yp
         )
-        return flux_total, flux_planet, flux_moon
+    return xp, yp, xm, ym
 
-    def coordinates(self, time):
-        flux_planet, flux_moon, flux_total, px, py, mx, my = pandora(
-            self.u1,
-            self.u2,
-            self.R_star,
 
-            # Planet parameters
-            self.per_bary,
-            self.a_bary,
-            self.r_planet,
-            self.b_bary,
-            self.w_bary,
-            self.ecc_bary,
-            self.t0_bary,
-            self.t0_bary_offset,
-            self.M_planet,
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def star_distances(xp, yp, xm, ym, unphysical, out=None):
+    """Distances z_planet, z_moon of planet and moon from (0,0) = center of star.
+    Written into the arrays of the tuple `out` = (z_planet, z_moon) if given"""
+    if out is None:
+        z_planet = np.empty(len(xp))
+        z_moon = np.empty(len(xp))
+    else:
+        z_planet, z_moon = out
+    for idx in range(len(xp)):
+        z_planet[idx] = sqrt(xp[idx] ** 2 + yp[idx] ** 2)
+        if unphysical:
+            z_moon[idx] = xm[idx]
+        else:
+            z_moon[idx] = sqrt(xm[idx] ** 2 + ym[idx] ** 2)
+    return z_planet, z_moon
 
-            # Moon parameters
-            self.r_moon,
-            self.per_moon,
-            self.tau_moon,
-            self.Omega_moon,
-            self.i_moon,
-            self.ecc_moon,
-            self.w_moon,
-            self.M_moon,
 
-            # Other model parameters
-            self.epoch_distance,
-            self.supersampling_factor,
-            self.occult_small_threshold,
-            self.hill_sphere_threshold,
-            self.numerical_grid,
-            time
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def planet_flux(z_planet, window, r_planet, u1, u2, cache=None, out=None, scratch=None):
+    """Flux of the star occulted by the planet, evaluated in the transit window.
+    The flux is 1 outside of the window. Written into `out` if given, without
+    allocations if the buffers `scratch` are given too, see window_flux."""
+    if scratch is not None:
+        return window_flux(z_planet, window, r_planet, u1, u2, False, cache, out, scratch)
+    if out is None:
+        flux_planet = np.ones(len(z_planet))
+    else:
+        flux_planet = out
+        flux_planet[:] = 1
+
+    # Cached Mandel-Agol occultation model if the cache covers the planet, else hybrid
+    if cache is not None and occult_cache_covers(r_planet, cache):
+        flux_planet[window] = read_cache(
+            zs_target=z_planet[window], 
+            k=r_planet, 
+            u1=u1,
+            u2=u2,
+            cache=cache
+        )
+    else:
+        flux_planet[window] = occult_hybrid(zs=z_planet[window], u1=u1, u2=u2, k=r_planet)
+        #flux_planet = occult(zs=z_planet, u1=u1, u2=u2, k=r_planet)
+    return flux_planet
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def moon_flux(
+    z_moon, window, r_moon, u1, u2, occult_small_threshold, cache=None, out=None,
+    scratch=None
+):
+    """Flux of the star occulted by the moon, without mutual eclipses, evaluated
+    in the transit window. The flux is 1 outside of the window. Written into
+    `out` if given, without allocations if the buffers `scratch` are given too,
+    see window_flux."""
+    if scratch is not None:
+        small = r_moon < occult_small_threshold
+        return window_flux(z_moon, window, r_moon, u1, u2, small, cache, out, scratch)
+    if out is None:
+        flux_moon = np.ones(len(z_moon))
+    else:
+        flux_moon = out
+        flux_moon[:] = 1
+
+    # For moon transit: User can "set occult_small_threshold > 0"
+    if r_moon < occult_small_threshold:
+        flux_moon[window] = occult_small(zs=z_moon[window], k=r_moon, u1=u1, u2=u2)
+    elif cache is not None and occult_cache_covers(r_moon, cache):
+        flux_moon[window] = read_cache(
+            zs_target=z_moon[window], k=r_moon, u1=u1, u2=u2, cache=cache
+        )
+    else:
+        flux_moon[window] = occult_hybrid(zs=z_moon[window], k=r_moon, u1=u1, u2=u2)
+    return flux_moon
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def window_flux(z, window, k, u1, u2, small, cache, out, scratch):
+    """planet_flux and moon_flux without allocations: The flux of the star
+    occulted by a body at the distances `z` is written into `out`. It is 1
+    outside of the window, and inside of it from occult_small if `small`, else
+    from the cache if it covers k, else from occult_hybrid. The distances and
+    fluxes in the window are gathered in the buffers of `scratch` =
+    (zs, flux, row, occult buffers) from create_workspace."""
+    zs, flux, row, occult_buffers = scratch
+    count = len(window)
+    zs = zs[:count]
+    flux = flux[:count]
+    for j in range(count):
+        zs[j] = z[window[j]]
+    if small:
+        occult_small_inplace(zs, k, u1, u2, flux)
+    elif cache is not None and occult_cache_covers(k, cache):
+        read_cache_inplace(zs, k, u1, u2, cache, flux, row)
+    else:
+        occult_hybrid_inplace(zs, k, u1, u2, flux, 7, occult_buffers)
+    out[:] = 1
+    for j in range(count):
+        out[window[j]] = flux[j]
+    return out
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def eclipse_events(xp, yp, xm, ym, window, r_planet, r_moon):
+    """Broad phase of the mutual planet-moon occultations: Indices of the cadences
+    in the window where the planet-moon separation allows an eclipse"""
+    return window[
+        eclipse_candidates(
+            xp[window], yp[window], xm[window], ym[window], r_planet, r_moon
         )
-        return px, py, mx, my
+    ]
 
 
 @jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def mutual_eclipses(
+    xp, yp, xm, ym, window, r_planet, r_moon, flux_moon, numerical_grid, buffers=None
+):
+    """Corrects flux_moon in place for mutual planet-moon occultations: Broad phase
+    from the planet-moon separation, narrow phase only for the remaining cadences.
+    The numerical solutions use the buffers from eclipse_buffers if given."""
+    for idx in window:
+        if (xm[idx] - xp[idx]) ** 2 + (ym[idx] - yp[idx]) ** 2 < (r_planet + r_moon) ** 2:
+            flux_moon[idx] = eclipse_single_value(
+                xp[idx],
+                yp[idx],
+                xm[idx],
+                ym[idx],
+                r_planet,
+                r_moon,
+                flux_moon[idx],
+                numerical_grid,
+                buffers
+            )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def downsample(flux, time, supersampling_factor, out=None):
+    """Supersampling downconversion, per cadence for segmented time grids.
+    Written into `out` (one value per cadence) if given"""
+    if grid_segmented(time):
+        supersampling_factors, first_samples = grid_segments(time)
+        if out is None:
+            return resample_segments(flux, supersampling_factors, first_samples)
+        return resample_segments_inplace(flux, supersampling_factors, first_samples, out)
+    if out is None:
+        if supersampling_factor > 1:
+            return resample(flux, supersampling_factor)
+        return flux
+    if supersampling_factor > 1:
+        return resample_inplace(flux, supersampling_factor, out)
+    out[:] = flux
+    return out
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def model_geometry(
+    R_star,
+    per_bary,
+    a_bary,
+    r_planet,
+    b_bary,
+    w_bary,
+    ecc_bary,
+    t0_bary,
+    t0_bary_offset,
+    M_planet,
+    r_moon,
+    per_moon,
+    tau_moon,
+    Omega_moon,
+    i_moon,
+    ecc_moon,
+    w_moon,
+    M_moon,
+    epoch_distance,
+    hill_sphere_threshold,
+    time,
+    kepler_cache=None,
+    out=None
+):
+    """Geometry of the model, independent of limb darkening: Coordinates xp, yp,
+    xm, ym, distances z_planet, z_moon from the star center, the transit window,
+    and whether mutual eclipses can occur. Used by pandora(), pandora_bands() and
+    pandora_inplace(), which passes the buffers
+    `out` = (x_bary, xp, yp, xm, ym, z_planet, z_moon, window) of the workspace"""
+
+    # Make sure to work with floats. Large values as ints would overflow.
+    R_star = float(R_star)
+    per_bary = float(per_bary)
+    a_bary = float(a_bary)
+    r_planet = float(r_planet)
+    b_bary = float(b_bary)
+    t0_bary = float(t0_bary)
+    t0_bary_offset = float(t0_bary_offset)
+    M_planet = float(M_planet)
+    r_moon = float(r_moon)
+    per_moon = float(per_moon)
+    tau_moon = float(tau_moon)
+    Omega_moon = float(Omega_moon)
+    i_moon = float(i_moon)
+    M_moon = float(M_moon)
+
+    if out is None:
+        n = grid_length(time)
+        x_bary = np.empty(n)
+        xp = np.empty(n)
+        yp = np.empty(n)
+        xm = np.empty(n)
+        ym = np.empty(n)
+        z_planet = np.empty(n)
+        z_moon = np.empty(n)
+    else:
+        x_bary, xp, yp, xm, ym, z_planet, z_moon, window = out
+
+    # Calculate moon period around planet
+    a_moon = moon_semimajor_axis(per_moon, M_planet, M_moon, R_star)
+
+    x_bary_grid_inplace(
+        time,
+        a_bary,
+        per_bary,
+        t0_bary,
+        t0_bary_offset,
+        epoch_distance,
+        ecc_bary,
+        w_bary,
+        x_bary
+    )
+
+    unphysical = unphysical_moon(
+        a_moon, a_bary, per_bary, R_star, M_planet, r_planet, r_moon, hill_sphere_threshold
+    )
+
+    xp, yp, xm, ym = orbit_coordinates(
+        a_moon,
+        per_moon,
+        tau_moon,
+        Omega_moon,
+        i_moon,
+        ecc_moon,
+        w_moon,
+        M_moon / M_planet,
+        b_bary,
+        time,
+        x_bary,
+        unphysical,
+        kepler_cache,
+        (xp, yp, xm, ym)
+    )
+
+    # Distances of planet and moon from (0,0) = center of star
+    # Not sufficient to only calculate z in ellipse func: 
+    # We also need full coordinates to determine mutual eclipses
+    z_planet, z_moon = star_distances(xp, yp, xm, ym, unphysical, (z_planet, z_moon))
+
+    # Transit window culling: Cadences where neither body can overlap the star
+    # keep flux = 1, the occultation and eclipse stages only see the others
+    limit = window_limit(a_moon, ecc_moon, r_planet, r_moon)
+    if out is None:
+        window = np.nonzero(np.abs(x_bary) < limit)[0]
+    else:
+        count = 0
+        for idx in range(len(x_bary)):
+            if abs(x_bary[idx]) < limit:
+                window[count] = idx
+                count += 1
+        window = window[:count]
+    eclipsing = not unphysical and eclipses_occur(
+        a_moon, ecc_moon, i_moon, r_planet, r_moon
+    )
+    return xp, yp, xm, ym, z_planet, z_moon, window, eclipsing
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False, nogil=True)
 def pandora(
     u1,
     u2,
@@ -336,8 +939,457 @@ def pandora(
     hill_sphere_threshold,
     numerical_grid,
     time,
-    cache=None
+    cache=None,
+    kepler_cache=None
+):
+
+    xp, yp, xm, ym, z_planet, z_moon, window, eclipsing = model_geometry(
+        R_star,
+        per_bary,
+        a_bary,
+        r_planet,
+        b_bary,
+        w_bary,
+        ecc_bary,
+        t0_bary,
+        t0_bary_offset,
+        M_planet,
+        r_moon,
+        per_moon,
+        tau_moon,
+        Omega_moon,
+        i_moon,
+        ecc_moon,
+        w_moon,
+        M_moon,
+        epoch_distance,
+        hill_sphere_threshold,
+        time,
+        kepler_cache
+    )
+    # Floats, as in model_geometry
+    r_planet = float(r_planet)
+    r_moon = float(r_moon)
+    flux_planet = planet_flux(z_planet, window, r_planet, u1, u2, cache)
+    flux_moon = moon_flux(z_moon, window, r_moon, u1, u2, occult_small_threshold, cache)
+    # Mutual planet-moon occultations
+    if eclipsing:
+        mutual_eclipses(xp, yp, xm, ym, window, r_planet, r_moon, flux_moon, numerical_grid)
+    flux_total = flux_moon + flux_planet - 1
+
+    # Supersampling downconversion
+    flux_planet = downsample(flux_planet, time, supersampling_factor)
+    flux_moon = downsample(flux_moon, time, supersampling_factor)
+    flux_total = downsample(flux_total, time, supersampling_factor)
+
+    return flux_planet, flux_moon, flux_total, xp, yp, xm, ym
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def hybrid_components(z, window, k, active):
+    """Distances in the transit window, with the indices and the limb-darkening
+    independent components (le, ld, ed) of the exact values of occult_hybrid.
+    Empty if not `active`. Evaluated with any limb darkening by hybrid_flux"""
+    if not active:
+        window = window[:0]
+    zs = z[window]
+    exact = occult_hybrid_exact(zs, k)
+    le, ld, ed = occult_components(zs[exact], k)
+    return zs, exact, le, ld, ed
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def hybrid_flux(length, window, k, u1, u2, components):
+    """Same as planet_flux and moon_flux without cache, from the components of
+    hybrid_components for the limb darkening (u1, u2)"""
+    zs, exact, le, ld, ed = components
+    flux = np.ones(length)
+    flux[window] = occult_hybrid_combine(
+        zs, k, u1, u2, exact, le, ld, ed, np.empty(len(window))
+    )
+    return flux
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False, nogil=True)
+def pandora_bands(
+    u1,
+    u2,
+    R_star,
+    # Planet parameters
+    per_bary,
+    a_bary,
+    r_planet,
+    b_bary,
+    w_bary,
+    ecc_bary,
+    t0_bary,
+    t0_bary_offset,
+    M_planet,
+    # Moon parameters
+    r_moon,
+    per_moon,
+    tau_moon,
+    Omega_moon,
+    i_moon,
+    ecc_moon,
+    w_moon,
+    M_moon,
+    # Other model parameters
+    epoch_distance,
+    supersampling_factor,
+    occult_small_threshold,
+    hill_sphere_threshold,
+    numerical_grid,
+    time,
+    cache=None,
+    kepler_cache=None
+):
+    """Same as pandora(), for several bandpasses with the limb darkening u1[band],
+    u2[band] of each band. The coordinates, the transit window and the mutual
+    eclipse ratios are computed once for all bands. Without a cache, so are the
+    limb-darkening independent components of the exact occultations. A cache
+    must be a component or spline cache: The one from create_occult_cache is
+    only valid for a single limb darkening. Returns flux_planet, flux_moon and
+    flux_total with one row per band, and the coordinates xp, yp, xm, ym."""
+    if cache is not None and len(cache) == 3 and len(u1) > 1:
+        raise ValueError(
+            "pandora_bands: the cache from create_occult_cache has a fixed limb "
+            "darkening, use a component or spline cache for several bands"
+        )
+
+    # Geometry, shared by all bands
+    xp, yp, xm, ym, z_planet, z_moon, window, eclipsing = model_geometry(
+        R_star,
+        per_bary,
+        a_bary,
+        r_planet,
+        b_bary,
+        w_bary,
+        ecc_bary,
+        t0_bary,
+        t0_bary_offset,
+        M_planet,
+        r_moon,
+        per_moon,
+        tau_moon,
+        Omega_moon,
+        i_moon,
+        ecc_moon,
+        w_moon,
+        M_moon,
+        epoch_distance,
+        hill_sphere_threshold,
+        time,
+        kepler_cache
+    )
+    # Floats, as in model_geometry
+    r_planet = float(r_planet)
+    r_moon = float(r_moon)
+
+    # Mutual planet-moon occultations: The eclipse ratios depend on the geometry only
+    events = np.empty(0, dtype=np.int64)
+    ratios = np.empty(0)
+    if eclipsing:
+        events = eclipse_events(xp, yp, xm, ym, window, r_planet, r_moon)
+        ratios = eclipse_ratios(
+            xp[events], yp[events], xm[events], ym[events], r_planet, r_moon, numerical_grid
+        )
+
+    # Bodies which are not covered by the cache use occult_hybrid, as in
+    # planet_flux and moon_flux: Its exact components are shared by all bands
+    planet_hybrid = True
+    moon_hybrid = r_moon >= occult_small_threshold
+    if cache is not None:
+        if occult_cache_covers(r_planet, cache):
+            planet_hybrid = False
+        if occult_cache_covers(r_moon, cache):
+            moon_hybrid = False
+    planet_components = hybrid_components(z_planet, window, r_planet, planet_hybrid)
+    moon_components = hybrid_components(z_moon, window, r_moon, moon_hybrid)
+
+    # Occultations with the limb darkening of each band
+    cadences = grid_cadences(time, supersampling_factor)
+    flux_planet = np.empty((len(u1), cadences))
+    flux_moon = np.empty((len(u1), cadences))
+    flux_total = np.empty((len(u1), cadences))
+    for band in range(len(u1)):
+        if planet_hybrid:
+            planet = hybrid_flux(
+                len(z_planet), window, r_planet, u1[band], u2[band], planet_components
+            )
+        else:
+            planet = planet_flux(z_planet, window, r_planet, u1[band], u2[band], cache)
+        if moon_hybrid:
+            moon = hybrid_flux(
+                len(z_moon), window, r_moon, u1[band], u2[band], moon_components
+            )
+        else:
+            moon = moon_flux(
+                z_moon, window, r_moon, u1[band], u2[band], occult_small_threshold, cache
+            )
+        for idx in range(len(events)):
+            moon[events[idx]] = eclipsed_flux(moon[events[idx]], ratios[idx])
+        total = moon + planet - 1
+        flux_planet[band] = downsample(planet, time, supersampling_factor)
+        flux_moon[band] = downsample(moon, time, supersampling_factor)
+        flux_total[band] = downsample(total, time, supersampling_factor)
+    return flux_planet, flux_moon, flux_total, xp, yp, xm, ym
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False, nogil=True)
+def pandora_packed(params, time, cache=None, kepler_cache=None):
+    """Same as pandora(), with the parameters from u1 to numerical_grid packed into
+    one float64 array of length 25, in the order of PARAMETERS. Passing one array
+    instead of 25 scalars reduces the call overhead. See model_params.pack()"""
+    return pandora(
+        params[0],
+        params[1],
+        params[2],
+        # Planet parameters
+        params[3],
+        params[4],
+        params[5],
+        params[6],
+        params[7],
+        params[8],
+        params[9],
+        params[10],
+        params[11],
+        # Moon parameters
+        params[12],
+        params[13],
+        params[14],
+        params[15],
+        params[16],
+        params[17],
+        params[18],
+        params[19],
+        # Other model parameters
+        params[20],
+        int(params[21]),
+        params[22],
+        params[23],
+        int(params[24]),
+        time,
+        cache,
+        kepler_cache
+    )
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=True)
+def pandora_batch(params, time, cache=None, kepler_cache=None):
+    """Evaluates pandora() for many parameter sets on one shared time grid.
+    Parameters
+    ----------
+    params: 2D array of shape (N, 25)
+        One parameter set per row, with columns in the order of the pandora()
+        arguments from u1 to numerical_grid: u1, u2, R_star, per_bary, a_bary,
+        r_planet, b_bary, w_bary, ecc_bary, t0_bary, t0_bary_offset, M_planet,
+        r_moon, per_moon, tau_moon, Omega_moon, i_moon, ecc_moon, w_moon, M_moon,
+        epoch_distance, supersampling_factor, occult_small_threshold,
+        hill_sphere_threshold, numerical_grid.
+        supersampling_factor must be identical for all rows.
+    time: 1D array or tuple
+        Time stamps shared by all parameter sets, or a descriptor from
+        timegrid_descriptor() or segmented_timegrid()
+    cache: tuple
+        Optional occultation cache, see create_occult_cache()
+    kepler_cache: tuple
+        Optional eccentric anomaly cache, see create_kepler_cache()
+    Returns
+    -------
+    flux_total: 2D array of shape (N, cadences)
+    """
+    cadences = grid_cadences(time, int(params[0, 21]))
+    flux_total = np.empty((len(params), cadences))
+    for row in prange(len(params)):
+        flux_total[row] = pandora_packed(params[row], time, cache, kepler_cache)[2]
+    return flux_total
+
+
+def pandora_pool(params, time, cache=None, kepler_cache=None, threads=None):
+    """Same as pandora_batch(), but evaluates the parameter sets with pandora()
+    in a pool of Python threads. pandora() releases the GIL, so the threads run
+    concurrently and share the time grid and the caches of this process.
+    threads: int
+        Optional number of threads, default as in ThreadPoolExecutor
+    """
+    params = np.atleast_2d(np.asarray(params, dtype=np.float64))
+    flux_total = np.empty((len(params), grid_cadences(time, int(params[0, 21]))))
+
+    def evaluate(row):
+        flux_total[row] = pandora_packed(params[row], time, cache, kepler_cache)[2]
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(evaluate, range(len(params))))
+    return flux_total
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=True)
+def pandora_parallel(
+    u1,
+    u2,
+    R_star,
+    # Planet parameters
+    per_bary,
+    a_bary,
+    r_planet,
+    b_bary,
+    w_bary,
+    ecc_bary,
+    t0_bary,
+    t0_bary_offset,
+    M_planet,
+    # Moon parameters
+    r_moon,
+    per_moon,
+    tau_moon,
+    Omega_moon,
+    i_moon,
+    ecc_moon,
+    w_moon,
+    M_moon,
+    # Other model parameters
+    epoch_distance,
+    supersampling_factor,
+    occult_small_threshold,
+    hill_sphere_threshold,
+    numerical_grid,
+    time,
+    cache=None,
+    kepler_cache=None
+):
+    """Same as pandora(), but one long light curve is evaluated on all threads.
+    The time grid is split into chunks of whole cadences at each planet epoch and
+    after 1/256 of all cadences (at least 1024), which are evaluated in parallel
+    with pandora(). The results are the same as from pandora()."""
+    cadences = grid_cadences(time, supersampling_factor)
+    n = grid_length(time)
+    chunks = epoch_chunks(
+        time,
+        supersampling_factor,
+        t0_bary + t0_bary_offset,
+        per_bary,
+        max(1024, cadences // 256)
+    )
+    flux_planet = np.empty(cadences)
+    flux_moon = np.empty(cadences)
+    flux_total = np.empty(cadences)
+    xp = np.empty(n)
+    yp = np.empty(n)
+    xm = np.empty(n)
+    ym = np.empty(n)
+    for chunk in prange(len(chunks) - 1):
+        first_cadence = chunks[chunk]
+        last_cadence = chunks[chunk + 1]
+        start = grid_cadence_samples(time, supersampling_factor, first_cadence)
+        end = grid_cadence_samples(time, supersampling_factor, last_cadence)
+        if chunk == len(chunks) - 2:
+            end = n
+        result = pandora(
+            u1,
+            u2,
+            R_star,
+            # Planet parameters
+            per_bary,
+            a_bary,
+            r_planet,
+            b_bary,
+            w_bary,
+            ecc_bary,
+            t0_bary,
+            t0_bary_offset,
+            M_planet,
+            # Moon parameters
+            r_moon,
+            per_moon,
+            tau_moon,
+            Omega_moon,
+            i_moon,
+            ecc_moon,
+            w_moon,
+            M_moon,
+            # Other model parameters
+            epoch_distance,
+            supersampling_factor,
+            occult_small_threshold,
+            hill_sphere_threshold,
+            numerical_grid,
+            grid_chunk(time, first_cadence, last_cadence, start, end),
+            cache,
+            kepler_cache
+        )
+        flux_planet[first_cadence:last_cadence] = result[0]
+        flux_moon[first_cadence:last_cadence] = result[1]
+        flux_total[first_cadence:last_cadence] = result[2]
+        xp[start:end] = result[3]
+        yp[start:end] = result[4]
+        xm[start:end] = result[5]
+        ym[start:end] = result[6]
+    return flux_planet, flux_moon, flux_total, xp, yp, xm, ym
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def contact_state(distance_squared, inner, outer):
+    """0 if a body is separated from the other, 1 if it overlaps its edge, 2 if it
+    is fully inside, for distances between the contact points `inner` and `outer`"""
+    if distance_squared >= outer ** 2:
+        return 0
+    if distance_squared > inner ** 2:
+        return 1
+    return 2
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False, nogil=True)
+def pandora_loglike(
+    u1,
+    u2,
+    R_star,
+    # Planet parameters
+    per_bary,
+    a_bary,
+    r_planet,
+    b_bary,
+    w_bary,
+    ecc_bary,
+    t0_bary,
+    t0_bary_offset,
+    M_planet,
+    # Moon parameters
+    r_moon,
+    per_moon,
+    tau_moon,
+    Omega_moon,
+    i_moon,
+    ecc_moon,
+    w_moon,
+    M_moon,
+    # Other model parameters
+    epoch_distance,
+    supersampling_factor,
+    occult_small_threshold,
+    hill_sphere_threshold,
+    numerical_grid,
+    time,
+    data,
+    yerr,
+    cache=None,
+    kepler_cache=None,
+    supersampling_tolerance=0.,
+    supersampling_nodes=0,
+    unphysical_loglike=None
 ):
+    """Gaussian log-likelihood -0.5 * sum(((data - flux_total) / yerr)**2) of the
+    pandora() model. Same parameters as pandora(), plus `data` and `yerr` with one
+    value per (resampled) cadence. The model is evaluated cadence by cadence and
+    the chi^2 is accumulated on the fly, so that no flux or coordinate arrays
+    are allocated.
+    With supersampling_tolerance > 0, a cadence is fully supersampled only where
+    its flux is not smooth within the exposure. Elsewhere, its mean follows from
+    five fluxes. With supersampling_nodes > 0, the exposure is integrated with
+    Gauss-Legendre quadrature of this order instead of the equally spaced samples.
+    If unphysical_loglike is given, it is returned at once for unphysical moons,
+    see unphysical_moon, instead of the likelihood of the planet-only model."""
 
     # Make sure to work with floats. Large values as ints would overflow.
     R_star = float(R_star)
@@ -356,111 +1408,368 @@ def pandora(
     M_moon = float(M_moon)
 
     # Calculate moon period around planet
-    G = 6.67408e-11
-    day = 60 * 60 * 24
-    a_moon = (
-        G * (M_planet + M_moon) / (2 * pi / (per_moon * day)) ** 2
-    ) ** (1 / 3)
-    a_moon /= R_star
-
-    x_bary = x_bary_grid(
-        time, 
-        a_bary, 
-        per_bary, 
-        t0_bary, 
-        t0_bary_offset, 
-        epoch_distance, 
-        ecc_bary, 
-        w_bary
+    a_moon = moon_semimajor_axis(per_moon, M_planet, M_moon, R_star)
+
+    unphysical = unphysical_moon(
+        a_moon, a_bary, per_bary, R_star, M_planet, r_planet, r_moon, hill_sphere_threshold
     )
+    if unphysical and unphysical_loglike is not None:
+        return float(unphysical_loglike)
 
-    # Check physical plausibility of a_moon
-    # Should be inside [Roche lobe, Hill sphere] plus/minus some user-set margin
-    M_star = ((4 * pi ** 2 / G) * ((a_bary * R_star) ** 3)) / (per_bary * day) ** 2
-    r_hill = a_bary * (M_planet / (3 * M_star)) ** (1 / 3)
-    r_hill_fraction = a_moon / r_hill
-    if r_hill_fraction > hill_sphere_threshold:
-        unphysical = True
-    else:
-        unphysical = False
+    tdur = transit_duration(a_bary, per_bary, ecc_bary, w_bary)
+    t0_shift_planet = t0_bary_offset / (tdur / 2)
+    mass_ratio = M_moon / M_planet
+    eclipses = eclipses_occur(a_moon, ecc_moon, i_moon, r_planet, r_moon)
 
-    # Roche lobe: Not used here, because we don't know densities of planet and moon
-    # Instead of taking density guesses, we just demand a_moon > (R_planet + R_moon)
-    if a_moon < (r_planet + r_moon):
-        unphysical = True
+    # Select the occultation model of each body once, with the same rules as pandora()
+    cache_planet = False
+    cache_moon = False
+    idx_planet, ratio_planet = 0, 0.
+    idx_moon, ratio_moon = 0, 0.
+    row_planet = np.empty(0)
+    row_moon = np.empty(0)
+    if cache is not None:
+        kind, table_0, table_1, table_2, grid = cache_arrays(cache)
+        if occult_cache_covers(r_planet, cache):
+            cache_planet = True
+            idx_planet, ratio_planet = read_occult_cache_index(r_planet, cache)
+            row_planet = cache_row(r_planet, u1, u2, cache)
+        if occult_cache_covers(r_moon, cache):
+            cache_moon = True
+            idx_moon, ratio_moon = read_occult_cache_index(r_moon, cache)
+            row_moon = cache_row(r_moon, u1, u2, cache)
+    small_moon = r_moon < occult_small_threshold
 
-    # Unphysical moon orbit: Keep planet, but put moon at far out of transit position
-    if unphysical:
-        bignum = 1e8
-        xp = x_bary
-        yp = np.full(len(x_bary), b_bary)
-        xm = np.full(len(x_bary), bignum)
-        ym = xm.copy()
-    else:  # valid, physical system
-        if ecc_moon == 0:
-            xm, ym, xp, yp = ellipse(
-                a=a_moon,
-                per=per_moon,
-                tau=tau_moon,
-                Omega=Omega_moon,
-                i=i_moon,
-                time=time,
-                x_bary=x_bary,
-                mass_ratio=M_moon / M_planet,
-                b_bary=b_bary,
-            )
+    # Kepler cache for eccentric moon orbits, with the same rules as pandora()
+    kepler_cached = False
+    orientation = (0., 0., 0., 0.)
+    idx_e, ratio_e = 0, 0.
+    Es = np.empty((0, 0))
+    if kepler_cache is not None and ecc_moon != 0:
+        if kepler_cache_covers(ecc_moon, kepler_cache):
+            kepler_cached = True
+            orientation = orbit_orientation(Omega_moon, w_moon, i_moon)
+            idx_e, ratio_e = kepler_cache_index(ecc_moon, kepler_cache)
+            Es = kepler_cache[0]
+    interpol_planet_1 = 0.
+    interpol_planet_2 = 0.
+    interpol_moon_1 = 0.
+    interpol_moon_2 = 0.
+    if not cache_planet:
+        interpol_planet_1, interpol_planet_2 = occult_hybrid_coefficients(r_planet, u1, u2)
+    if not cache_moon and not small_moon and not unphysical:
+        interpol_moon_1, interpol_moon_2 = occult_hybrid_coefficients(r_moon, u1, u2)
+
+    limit = window_limit(a_moon, ecc_moon, r_planet, r_moon)
+
+    def flux_at(t):
+        """Total flux at time t, and the configuration from contact_state() of
+        the planet, the moon and the planet-moon overlap as 1 + p + 3 m + 9 e"""
+        x_bary = x_bary_single_value(
+            t, tdur, per_bary, t0_bary, t0_shift_planet, epoch_distance
+        )
+
+        # Transit window culling: Neither body can overlap the star
+        if abs(x_bary) >= limit:
+            return 1., 0
+
+        # Unphysical moon orbit: Keep planet, moon is far out of transit
+        state = 1
+        if unphysical:
+            xp = x_bary
+            yp = b_bary
+            flux_moon = 1.
+        else:
+            if ecc_moon == 0:
+                xm, ym, xp, yp = ellipse_single_value(
+                    a_moon, per_moon, tau_moon, Omega_moon, i_moon, t, x_bary,
+                    mass_ratio, b_bary
+                )
+            elif kepler_cached:
+                xm, ym, xp, yp = ellipse_ecc_cached_single_value(
+                    a_moon, per_moon, ecc_moon, tau_moon, t, mass_ratio, x_bary,
+                    b_bary, orientation, idx_e, ratio_e, Es
+                )
+            else:
+                xm, ym, xp, yp = ellipse_ecc_single_value(
+                    a_moon, per_moon, ecc_moon, tau_moon, Omega_moon, w_moon,
+                    i_moon, t, mass_ratio, x_bary, b_bary
+                )
+            z_moon = sqrt(xm ** 2 + ym ** 2)
+            state += 3 * contact_state(z_moon ** 2, 1 - r_moon, 1 + r_moon)
+            if small_moon:
+                if z_moon < 1 + r_moon:
+                    flux_moon = occult_small_single_value(z_moon, r_moon, u1, u2)
+                else:
+                    flux_moon = 1.
+            elif cache is not None and cache_moon:
+                if len(cache) == 4:
+                    flux_moon = read_spline_cache_row_single_value(
+                        z_moon, r_moon, row_moon
+                    )
+                else:
+                    flux_moon = read_cache_single_value(
+                        z_moon, r_moon, idx_moon, ratio_moon, u1, u2,
+                        kind, table_0, table_1, table_2, grid
+                    )
+            else:
+                flux_moon = occult_hybrid_single_value(
+                    z_moon, r_moon, u1, u2, interpol_moon_1, interpol_moon_2
+                )
+            if eclipses:
+                flux_moon = eclipse_single_value(
+                    xp, yp, xm, ym, r_planet, r_moon, flux_moon, numerical_grid
+                )
+                state += 9 * contact_state(
+                    (xp - xm) ** 2 + (yp - ym) ** 2,
+                    abs(r_planet - r_moon),
+                    r_planet + r_moon
+                )
+
+        z_planet = sqrt(xp ** 2 + yp ** 2)
+        state += contact_state(z_planet ** 2, 1 - r_planet, 1 + r_planet)
+        if cache is not None and cache_planet:
+            if len(cache) == 4:
+                flux_planet = read_spline_cache_row_single_value(
+                    z_planet, r_planet, row_planet
+                )
+            else:
+                flux_planet = read_cache_single_value(
+                    z_planet, r_planet, idx_planet, ratio_planet, u1, u2,
+                    kind, table_0, table_1, table_2, grid
+                )
         else:
-            xm, ym, xp, yp = ellipse_ecc(
-                a=a_moon,
-                per=per_moon,
-                e=ecc_moon,
-                tau=tau_moon,
-                Omega=Omega_moon,
-                w=w_moon,
-                i=i_moon,
-                time=time,
-                mass_ratio=M_moon / M_planet,
-                x_bary=x_bary,
-                b_bary=b_bary,
+            flux_planet = occult_hybrid_single_value(
+                z_planet, r_planet, u1, u2, interpol_planet_1, interpol_planet_2
             )
+        return flux_moon + flux_planet - 1, state
 
-    # Distances of planet and moon from (0,0) = center of star
-    # Not sufficient to only calculate z in ellipse func: 
-    # We also need full coordinates to determine mutual eclipses below
-    z_planet = sqrt(xp ** 2 + yp ** 2)
-    if unphysical:
-        z_moon = xm.copy()
-    else:
-        z_moon = sqrt(xm ** 2 + ym ** 2)
+    # Supersampling downconversion: Same averaging as resample(), or as
+    # resample_segments() with the samples of each cadence for segmented grids
+    cadences = grid_cadences(time, supersampling_factor)
+    supersampling_factors, first_samples = grid_segments(time)
+    segmented = len(supersampling_factors) > 0
+    samples = max(supersampling_factor - 1, 1)
 
-    # Cached Mandel-Agol occultation model for planet < 0.1, else hybrid
-    if cache is not None and r_planet < 0.1:
-        flux_planet = read_occult_cache(
-            zs_target=z_planet, 
-            k=r_planet, 
-            cache=cache
-        )
-    else:
-        flux_planet = occult_hybrid(zs=z_planet, u1=u1, u2=u2, k=r_planet)
-        #flux_planet = occult(zs=z_planet, u1=u1, u2=u2, k=r_planet)
-    
-    # For moon transit: User can "set occult_small_threshold > 0"
-    if r_moon < occult_small_threshold:
-        flux_moon = occult_small(zs=z_moon, k=r_moon, u1=u1, u2=u2)
-    elif cache is not None and r_moon < 0.1:
-        flux_moon = read_occult_cache(zs_target=z_moon, k=r_moon, cache=cache)
-    else:
-        flux_moon = occult_hybrid(zs=z_moon, k=r_moon, u1=u1, u2=u2)
+    # Exposure of a cadence: The samples which are averaged, each of them
+    # standing for one time step. Gauss-Legendre nodes span the same interval.
+    nodes, weights = gauss_legendre(max(supersampling_nodes, 1))
+    samples_moments = 0
+    chi2 = 0.
+    epoch = 0
+    first = 0
+    for idx in range(cadences):
+        if segmented:
+            start = first_samples[idx]
+            samples = supersampling_factors[idx]
+        else:
+            start = idx * max(supersampling_factor, 1)
+        quadrature = supersampling_nodes > 0 and samples > 1
+        adaptive = supersampling_tolerance > 0 and samples > 5
+
+        # Moments of the exposure in units of the half distance from the first to
+        # the last sample: Continuous for the quadrature, else over the samples
+        if samples != samples_moments:
+            samples_moments = samples
+            half_width = samples / max(samples - 1, 1)
+            if quadrature:
+                moment_2 = half_width ** 2 / 3
+                moment_4 = half_width ** 4 / 5
+            else:
+                moment_2 = 0.
+                moment_4 = 0.
+                for sample in range(samples):
+                    x = 2 * sample / max(samples - 1, 1) - 1
+                    moment_2 += x ** 2 / samples
+                    moment_4 += x ** 4 / samples
+        resolved = False
+        # The cursor of a descriptor only moves forward: Keep it at the first
+        # sample, where the full exposure below starts again
+        t_first, epoch, first = grid_time(time, start, epoch, first)
+        t_last = grid_time(time, start + samples - 1, epoch, first)[0]
+        t_mid = 0.5 * (t_first + t_last)
+        t_half = 0.5 * (t_last - t_first)
+
+        # Adaptive: Mean of the exposure from the polynomials through 3 and through
+        # 5 fluxes between the first and the last sample. If they agree, the
+        # latter is used. Else, e.g. at contact points and mutual-event edges,
+        # the full exposure is evaluated
+        if adaptive:
+            flux_0, state_0 = flux_at(t_mid)
+            flux_a, state_a = flux_at(t_mid - 0.5 * t_half)
+            flux_b, state_b = flux_at(t_mid + 0.5 * t_half)
+            flux_c, state_c = flux_at(t_first)
+            flux_d, state_d = flux_at(t_last)
+            flux_1 = flux_a + flux_b - 2 * flux_0
+            flux_2 = flux_c + flux_d - 2 * flux_0
+            mean_3 = flux_0 + 0.5 * moment_2 * flux_2
+            coefficient_4 = (2 * flux_2 - 8 * flux_1) / 3
+            coefficient_2 = 2 * flux_1 - coefficient_4 / 4
+            mean_5 = flux_0 + moment_2 * coefficient_2 + moment_4 * coefficient_4
+
+            # No contact point within the exposure, where the flux is not smooth
+            smooth = state_0 == state_a == state_b == state_c == state_d
+            if smooth and abs(mean_5 - mean_3) < supersampling_tolerance:
+                flux = mean_5
+                resolved = True
+        if not resolved:
+            if quadrature:
+                flux = 0.
+                for node in range(supersampling_nodes):
+                    t = t_mid + nodes[node] * t_half * half_width
+                    flux += weights[node] * flux_at(t)[0]
+                flux *= 0.5
+            else:
+                flux = 0.
+                for sample in range(samples):
+                    t, epoch, first = grid_time(time, start + sample, epoch, first)
+                    flux += flux_at(t)[0]
+                flux /= samples
+        chi2 += ((data[idx] - flux) / yerr[idx]) ** 2
+    return -0.5 * chi2
+
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False)
+def create_workspace(time, supersampling_factor, numerical_grid=25, cache=None):
+    """Preallocated buffers for pandora_inplace(), valid for all calls with a time
+    grid of the same length and the same supersampling_factor. The buffers of the
+    mutual eclipses and of the spline cache are sized for a numerical_grid up to
+    the one given and for the `cache` of the calls"""
+    n = grid_length(time)
+    n_resampled = grid_cadences(time, supersampling_factor)
+    return (
+        np.empty(n),  # x_bary
+        np.empty(n),  # xp
+        np.empty(n),  # yp
+        np.empty(n),  # xm
+        np.empty(n),  # ym
+        np.empty(n),  # z_planet
+        np.empty(n),  # z_moon
+        np.empty(n, dtype=np.int64),  # transit window
+        np.empty(n),  # flux_planet
+        np.empty(n),  # flux_moon
+        np.empty(n),  # flux_total
+        np.empty(n_resampled),  # flux_planet, resampled
+        np.empty(n_resampled),  # flux_moon, resampled
+        np.empty(n_resampled),  # flux_total, resampled
+        (
+            np.empty(n),  # distances in the window
+            np.empty(n),  # fluxes in the window
+            np.empty(spline_cache_dim(cache)),  # row of the spline cache
+            occult_scratch(n),
+        ),
+        eclipse_buffers(numerical_grid),
+    )
 
+
+@jit(cache=True, nopython=True, fastmath=True, parallel=False, nogil=True)
+def pandora_inplace(
+    u1,
+    u2,
+    R_star,
+    # Planet parameters
+    per_bary,
+    a_bary,
+    r_planet,
+    b_bary,
+    w_bary,
+    ecc_bary,
+    t0_bary,
+    t0_bary_offset,
+    M_planet,
+    # Moon parameters
+    r_moon,
+    per_moon,
+    tau_moon,
+    Omega_moon,
+    i_moon,
+    ecc_moon,
+    w_moon,
+    M_moon,
+    # Other model parameters
+    epoch_distance,
+    supersampling_factor,
+    occult_small_threshold,
+    hill_sphere_threshold,
+    numerical_grid,
+    time,
+    workspace,
+    cache=None,
+    kepler_cache=None
+):
+    """Same as pandora(), but all stages write into the buffers of a `workspace`
+    from create_workspace(time, supersampling_factor, numerical_grid, cache), so
+    that nothing is allocated on the heap. Only for a numerical_grid larger than
+    the one of the workspace, or a spline cache with longer rows than the one of
+    the workspace, the pixelart image or the row of the cache are allocated. The
+    returned arrays are views into the workspace and are overwritten by the next
+    call with the same workspace."""
+    (
+        x_bary,
+        xp,
+        yp,
+        xm,
+        ym,
+        z_planet,
+        z_moon,
+        window,
+        flux_planet,
+        flux_moon,
+        flux_total,
+        flux_planet_resampled,
+        flux_moon_resampled,
+        flux_total_resampled,
+        scratch,
+        buffers,
+    ) = workspace
+    xp, yp, xm, ym, z_planet, z_moon, window, eclipsing = model_geometry(
+        R_star,
+        per_bary,
+        a_bary,
+        r_planet,
+        b_bary,
+        w_bary,
+        ecc_bary,
+        t0_bary,
+        t0_bary_offset,
+        M_planet,
+        r_moon,
+        per_moon,
+        tau_moon,
+        Omega_moon,
+        i_moon,
+        ecc_moon,
+        w_moon,
+        M_moon,
+        epoch_distance,
+        hill_sphere_threshold,
+        time,
+        kepler_cache,
+        (x_bary, xp, yp, xm, ym, z_planet, z_moon, window)
+    )
+    # Floats, as in model_geometry
+    r_planet = float(r_planet)
+    r_moon = float(r_moon)
+    planet_flux(z_planet, window, r_planet, u1, u2, cache, flux_planet, scratch)
+    moon_flux(
+        z_moon, window, r_moon, u1, u2, occult_small_threshold, cache, flux_moon,
+        scratch
+    )
     # Mutual planet-moon occultations
-    if not unphysical:# and eclipses_occur:
-        flux_moon = eclipse(xp, yp, xm, ym, r_planet, r_moon, flux_moon, numerical_grid)
-    flux_total = flux_moon + flux_planet - 1
+    if eclipsing:
+        mutual_eclipses(
+            xp, yp, xm, ym, window, r_planet, r_moon, flux_moon, numerical_grid, buffers
+        )
+    for idx in range(len(flux_total)):
+        flux_total[idx] = flux_moon[idx] + flux_planet[idx] - 1
 
     # Supersampling downconversion
-    if supersampling_factor > 1:
-        flux_planet = resample(flux_planet, supersampling_factor)
-        flux_moon = resample(flux_moon, supersampling_factor)
-        flux_total = resample(flux_total, supersampling_factor)
-
-    return flux_planet, flux_moon, flux_total, xp, yp, xm, ym
+    return (
+        downsample(flux_planet, time, supersampling_factor, flux_planet_resampled),
+        downsample(flux_moon, time, supersampling_factor, flux_moon_resampled),
+        downsample(flux_total, time, supersampling_factor, flux_total_resampled),
+        xp,
+        yp,
+        xm,
+        ym
+    )